@@ -0,0 +1,72 @@
+from __future__ import annotations
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dungeonGeneratorClass import DungeonGenerator, DungeonBuildError, Room, GeneratorConfig
+
+
+# Per-process generator, built once by init_worker so the prefabs are only pickled once per worker
+worker_generator: DungeonGenerator = None
+
+
+def dungeon_seed(base_seed: int, index: int):
+    # Returns the seed of the index-th dungeon in a batch
+    # Depends only on the base seed and the index, never on which worker builds the dungeon
+    return f'{base_seed}:{index}'
+
+
+def compact_path(path: list):
+    # Returns the path as a tuple of (room name, x, y, exit door index) tuples
+    output = []
+    for room, door in path:
+        exit_i = -1
+        for i in range(len(room.doors)):
+            if room.get_door(i) == door:
+                exit_i = i
+                break
+        output.append((room.name, room.x, room.y, exit_i))
+    return tuple(output)
+
+
+def init_worker(start: Room, grid_w: int, grid_h: int, prefabs: list[Room], bucket_size: int, collision: str,
+                config: GeneratorConfig, scoring: str = 'auto', heuristic: str = 'euclid', field_cell: int = 10):
+    # ProcessPoolExecutor initializer, receives the start room, prefabs and settings once per worker process
+    global worker_generator
+    worker_generator = DungeonGenerator(start, grid_w, grid_h, prefabs, bucket_size, collision, scoring=scoring,
+                                        config=config, heuristic=heuristic, field_cell=field_cell)
+
+
+def build_range(first: int, last: int, base_seed: int):
+    # Builds dungeons first through last - 1 on this worker's generator
+    # Returns a list of (index, build time, compact path), the path being None for builds that ran out of budget
+    g = worker_generator
+    results = []
+    for index in range(first, last):
+        g.rng = random.Random(dungeon_seed(base_seed, index))
+        g.reset_path(g.start)
+        try:
+            build_time = g.build_dungeon()
+        except DungeonBuildError as error:
+            results.append((index, error.elapsed, None))
+            continue
+        results.append((index, build_time, compact_path(g.path)))
+    return results
+
+
+def generate_batch(generator: DungeonGenerator, count: int, base_seed: int, workers: int = None,
+                   ordered: bool = True, chunk_size: int = 32):
+    # Yields (index, build time, compact path) for count dungeons built with generator's start, grid, prefabs,
+    # config and collision, scoring and heuristic settings
+    # The compact path is None for dungeons that ran out of build budget
+    # Dungeon i is always built from dungeon_seed(base_seed, i), so paths are identical for any worker count
+    # ordered=True yields in submission order, otherwise results are yielded chunk by chunk as they finish
+    initargs = (generator.start, generator.grid_w, generator.grid_h, generator.prefabs, generator.bucket_size,
+                generator.collision, generator.config, generator.scoring, generator.heuristic, generator.field_cell)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as pool:
+        futures = [pool.submit(build_range, first, min(first + chunk_size, count), base_seed)
+                   for first in range(0, count, chunk_size)]
+        if ordered:
+            for future in futures:
+                yield from future.result()
+        else:
+            for future in as_completed(futures):
+                yield from future.result()
@@ -0,0 +1,204 @@
+from __future__ import annotations
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import dungeonGeneratorClass as dg
+from dungeonGeneratorClass import DungeonGenerator, DungeonBuildError, Door, Room, GeneratorConfig
+from percentiles import percentile
+
+
+# Configuration every sweep starts from; each sweep axis varies one of these keys
+BASELINE: dict = {
+    'grid': 500,
+    'path_length': 15,
+    'allowed_fails': 3,
+    'room_random': .7,
+    'door_random': .65,
+    'extra_prefabs': 0,
+}
+
+SWEEP: dict = {
+    'grid': [250, 500, 1000, 2000],
+    'path_length': [5, 15, 30, 60],
+    'allowed_fails': [1, 3, 6],
+    'room_random': [.5, .7, .9, 1.0],
+    'door_random': [.5, .65, .9, 1.0],
+    'extra_prefabs': [0, 50, 250, 1000],
+}
+
+QUICK_SWEEP: dict = {
+    'grid': [500, 1000],
+    'path_length': [15, 30],
+    'extra_prefabs': [0, 100],
+}
+
+# Config keys passed straight to the generator's GeneratorConfig
+CONFIG_FIELDS: tuple = ('path_length', 'allowed_fails', 'room_random', 'door_random')
+
+
+def synthetic_prefabs(count: int, seed: int = 0):
+    # Returns count random rectangular prefabs with two to four doors centered on their edges
+    rng = random.Random(seed)
+    output = []
+    for i in range(count):
+        w = rng.randrange(10, 70, 2)
+        h = rng.randrange(10, 70, 2)
+        doors = [Door(w // 2, 0, 'S'), Door(w // 2, h, 'N'), Door(0, h // 2, 'W'), Door(w, h // 2, 'E')]
+        output.append(Room(0, 0, w, h, 'synthetic ' + str(i), rng.sample(doors, rng.randint(2, 4))))
+    return output
+
+
+def sweep_configs(sweep: dict):
+    # Returns the baseline plus one config per swept value, varying one key at a time
+    configs = [dict(BASELINE)]
+    for key, values in sweep.items():
+        for value in values:
+            if value != BASELINE[key]:
+                config = dict(BASELINE)
+                config[key] = value
+                configs.append(config)
+    return configs
+
+
+def make_generator(config: dict, collision: str, scoring: str):
+    # Builds a generator for config, with the bundled prefabs plus config['extra_prefabs'] synthetic ones
+    grid = config['grid']
+    start = Room(grid // 2 - 20, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    prefabs = list(dg.prefabs) + synthetic_prefabs(config['extra_prefabs'])
+    generator_config = GeneratorConfig(**{key: config[key] for key in CONFIG_FIELDS})
+    g = DungeonGenerator(start, grid, grid, prefabs, collision=collision, scoring=scoring, config=generator_config)
+    g.add_rotated_prefabs()
+    return g
+
+
+def run_builds(g: DungeonGenerator, count: int, seed: int, deadline: float):
+    # Builds count seeded dungeons on g
+    # Returns (successful build times, failures, timeouts)
+    times = []
+    failures = 0
+    timeouts = 0
+    for i in range(count):
+        g.rng = random.Random(f'{seed}:{i}')
+        g.reset_path(g.start)
+        try:
+            times.append(g.build_dungeon(deadline=deadline))
+        except DungeonBuildError as error:
+            if error.reason == 'deadline':
+                timeouts += 1
+            else:
+                failures += 1
+    return times, failures, timeouts
+
+
+def run_config(config: dict, count: int, seed: int, deadline: float, memory_builds: int, collision: str,
+               scoring: str):
+    # Runs one configuration and returns its result dict
+    g = make_generator(config, collision, scoring)
+
+    wall_start = time.perf_counter()
+    times, failures, timeouts = run_builds(g, count, seed, deadline)
+    wall = time.perf_counter() - wall_start
+
+    # Separate pass, since tracing allocations slows the builds down
+    tracemalloc.start()
+    run_builds(g, memory_builds, seed, deadline)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'config': config,
+        'prefab_count': len(g.prefabs),
+        'builds': count,
+        'p50': percentile(times, 50),
+        'p95': percentile(times, 95),
+        'p99': percentile(times, 99),
+        'throughput': len(times) / wall if wall > 0 else None,
+        'failure_rate': failures / count,
+        'timeout_rate': timeouts / count,
+        'peak_memory': peak,
+    }
+
+
+def git_revision():
+    # Returns the current commit hash, or None outside a git checkout
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def describe(config: dict):
+    # Returns the keys of config that differ from the baseline, for display
+    changed = {key: value for key, value in config.items() if value != BASELINE[key]}
+    return str(changed) if changed else 'baseline'
+
+
+def config_key(config: dict):
+    return json.dumps(config, sort_keys=True)
+
+
+def compare(old: dict, new: dict):
+    # Prints the p50/p99 and throughput ratios (new / old) of configurations present in both result files
+    old_results = {config_key(result['config']): result for result in old['results']}
+    print(f"{'config':<40} {'p50':>8} {'p99':>8} {'dungeons/s':>11}")
+    for result in new['results']:
+        before = old_results.get(config_key(result['config']))
+        if before is None:
+            continue
+        ratios = []
+        for field in ['p50', 'p99', 'throughput']:
+            if before[field] and result[field] is not None:
+                ratios.append(f'{result[field] / before[field]:.2f}x')
+            else:
+                ratios.append('-')
+        print(f"{describe(result['config']):<40} {ratios[0]:>8} {ratios[1]:>8} {ratios[2]:>11}")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Seeded build_dungeon benchmark sweep')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to')
+    parser.add_argument('--dungeons', type=int, default=200, help='builds per configuration')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--deadline', type=float, default=2.0, help='per-build time limit in seconds')
+    parser.add_argument('--memory-builds', type=int, default=20, help='builds traced for peak memory')
+    parser.add_argument('--collision', default='index', choices=['index', 'bitmap'])
+    parser.add_argument('--scoring', default='auto', choices=['scalar', 'vector', 'auto'])
+    parser.add_argument('--quick', action='store_true', help='run a reduced sweep')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    results = []
+    for config in sweep_configs(QUICK_SWEEP if args.quick else SWEEP):
+        result = run_config(config, args.dungeons, args.seed, args.deadline, args.memory_builds, args.collision,
+                            args.scoring)
+        results.append(result)
+        p50 = result['p50'] * 1000 if result['p50'] is not None else float('nan')
+        p99 = result['p99'] * 1000 if result['p99'] is not None else float('nan')
+        print(f"{describe(config):<40} p50 {p50:8.3f}ms  p99 {p99:8.3f}ms  {result['throughput'] or 0:9.1f}/s  "
+              f"fail {result['failure_rate']:.2%}  timeout {result['timeout_rate']:.2%}  "
+              f"peak {result['peak_memory'] / 1024:.0f}KiB")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {'dungeons': args.dungeons, 'seed': args.seed, 'deadline': args.deadline,
+                     'collision': args.collision, 'scoring': args.scoring},
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+from __future__ import annotations
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dungeonGeneratorClass import DungeonGenerator, DungeonBuildError, Door, Room, SpatialIndex, GeneratorConfig
+from dungeonSerializer import prefab_ids, room_records, path_from_records
+
+
+# Rooms per side branch, counting the room it grows from; branches end in an ordinary room, never the finish
+BRANCH_LENGTH: int = 6
+# Distance beyond its door of the point a branch is steered towards, which keeps each branch to its own region
+BRANCH_REACH: int = 150
+# Placement attempts a branch gets before it is given up on
+BRANCH_ATTEMPTS: int = 500
+
+# Unit step of each door direction
+DIRECTION_STEP: dict = {'N': (0, 1), 'S': (0, -1), 'E': (1, 0), 'W': (-1, 0)}
+
+# Per-process generator, built once by init_worker like batchGenerator's
+worker_generator: DungeonGenerator = None
+
+
+class Branch:
+    # A side branch of a dungeon, growing from door door_i of the room at path index anchor_i
+    # path holds the branch's own rooms as (room, door), starting with the room placed on the anchor door
+    __slots__ = ('anchor_i', 'door_i', 'path')
+
+    def __init__(self, anchor_i: int, door_i: int, path: list):
+        self.anchor_i = anchor_i
+        self.door_i = door_i
+        self.path = path
+
+
+def unused_doors(path: list):
+    # Returns (path index, door index) of every door that neither leads into its room nor on to the next one
+    output = []
+    for i, (room, door) in enumerate(path):
+        for j in range(len(room.doors)):
+            if j == room.entrance_i:
+                continue
+            if i < len(path) - 1 and room.get_door(j) == door:
+                continue
+            output.append((i, j))
+    return output
+
+
+def branch_goal(door: Door, grid_w: int, grid_h: int):
+    # Returns the point BRANCH_REACH beyond door in the direction it faces, kept inside the grid
+    step_x, step_y = DIRECTION_STEP[door.d]
+    x = min(max(door.x + step_x * BRANCH_REACH, 0), grid_w - 10)
+    y = min(max(door.y + step_y * BRANCH_REACH, 0), grid_h - 10)
+    return x, y
+
+
+def init_worker(start: Room, grid_w: int, grid_h: int, prefabs: list[Room], bucket_size: int, collision: str,
+                config: GeneratorConfig, scoring: str = 'auto', heuristic: str = 'euclid', field_cell: int = 10):
+    # ProcessPoolExecutor initializer, receives the start room, prefabs, branch config and the main generator's
+    # scoring and heuristic settings once per worker process
+    global worker_generator
+    worker_generator = DungeonGenerator(start, grid_w, grid_h, prefabs, bucket_size, collision, scoring=scoring,
+                                        config=config, heuristic=heuristic, field_cell=field_cell)
+
+
+def build_branch(main_records: list, anchor_i: int, door_i: int, seed, max_attempts: int):
+    # Grows one branch from a door of the main path (given as dungeonSerializer room records), every room of the
+    # main path being an obstacle
+    # Returns (anchor index, door index, room records of the branch without its anchor, or None if it failed)
+    g = worker_generator
+    main = path_from_records(g, main_records)
+    anchor = main[anchor_i][0]
+    door = anchor.get_door(door_i)
+    g.rng = random.Random(seed)
+    g.reset_path(anchor, door)
+    for room, room_door in main:
+        if room is not anchor:
+            g.index.add(room)
+    g.target = branch_goal(door, g.grid_w, g.grid_h)
+    try:
+        g.build_dungeon(max_attempts=max_attempts)
+    except DungeonBuildError:
+        return anchor_i, door_i, None
+    return anchor_i, door_i, room_records(g.path[1:], prefab_ids(g))
+
+
+def merge_branches(generator: DungeonGenerator, results: list):
+    # Turns build_branch results into Branches, checking each against the main path and the branches merged
+    # before it. A branch is cut short at its first room that conflicts, and dropped if that is its first room
+    # Returns (branches, number of branches cut short or dropped)
+    index = SpatialIndex(generator.bucket_size)
+    for room, door in generator.path:
+        index.add(room)
+    branches = []
+    conflicts = 0
+    for anchor_i, door_i, records in results:
+        if records is None:
+            continue
+        path = path_from_records(generator, records)
+        kept = []
+        for room, door in path:
+            if index.hits(room):
+                conflicts += 1
+                break
+            kept.append((room, door))
+        for room, door in kept:
+            index.add(room)
+        if kept:
+            branches.append(Branch(anchor_i, door_i, kept))
+    return branches, conflicts
+
+
+class BranchBuilder:
+    # Grows side branches from the unused doors of a generator's current path in a pool of worker processes
+    # The pool is started once, so it can serve many dungeons; use as a context manager or call close()
+    # Branches are independent and built in parallel, then merged in door order, so the result only depends on
+    # the path and the seed, and a branching dungeon takes about as long as its main path plus one branch
+    def __init__(self, generator: DungeonGenerator, workers: int = None, branch_length: int = BRANCH_LENGTH):
+        self.generator = generator
+        initargs = (generator.start, generator.grid_w, generator.grid_h, generator.prefabs, generator.bucket_size,
+                    generator.collision, generator.config.replace(path_length=branch_length, finish=False),
+                    generator.scoring, generator.heuristic, generator.field_cell)
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs)
+        # Branches cut short or dropped by the last grow
+        self.conflicts = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def grow(self, base_seed, max_branches: int = None, max_attempts: int = BRANCH_ATTEMPTS):
+        # Returns the Branches grown from (up to max_branches of) the unused doors of the generator's path
+        # Branch seeds are derived from base_seed and the door, never from which worker builds the branch
+        g = self.generator
+        records = room_records(g.path, prefab_ids(g))
+        doors = unused_doors(g.path)[:max_branches]
+        futures = [self.pool.submit(build_branch, records, anchor_i, door_i, f'{base_seed}:{anchor_i}:{door_i}',
+                                    max_attempts)
+                   for anchor_i, door_i in doors]
+        branches, self.conflicts = merge_branches(g, [future.result() for future in futures])
+        return branches
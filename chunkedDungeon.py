@@ -0,0 +1,352 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import random
+import struct
+from collections import OrderedDict
+from dungeonGeneratorClass import DungeonGenerator, DungeonBuildError, Door, Room, PlacedRoom, GeneratorConfig, \
+    OPPOSITE, DOOR_GAP
+from dungeonSerializer import ROOM, catalog_hash, check_table, generator_params, room_records
+
+
+# Portal rooms sit flush against a chunk's usable area, door 0 facing into the chunk and door 1 on its border
+# A chunk only uses 0 to chunk size - 1 on both axes, leaving a one unit gap along its E and N edges, so the edge
+# door of a portal faces the neighbouring chunk's portal door one unit away, like the doors of any connected rooms
+PORTAL_PREFABS: dict = {
+    'W': Room(0, 0, 20, 20, 'portal', [Door(20, 10, 'E'), Door(0, 10, 'W')]),
+    'E': Room(0, 0, 20, 20, 'portal', [Door(0, 10, 'W'), Door(20, 10, 'E')]),
+    'S': Room(0, 0, 20, 20, 'portal', [Door(10, 20, 'N'), Door(10, 0, 'S')]),
+    'N': Room(0, 0, 20, 20, 'portal', [Door(10, 0, 'S'), Door(10, 20, 'N')]),
+}
+SIDES: tuple = ('W', 'E', 'S', 'N')
+
+# Most rooms a leg may grow to before it counts as failed (the legs' path_length)
+LEG_LENGTH: int = 40
+# Times a chunk is regrown from a new seed when one of its legs can't reach the rooms placed before it
+CHUNK_RETRIES: int = 8
+# Largest side of a bridge room (that of the biggest bundled prefab), its smallest side, and the least distance of
+# its doors from its corners
+BRIDGE_REACH: int = 60
+BRIDGE_MIN: int = 10
+BRIDGE_MARGIN: int = 5
+# Bound of a bridge room fixed by docking onto a door facing the key direction, and the axis along that wall
+DOCK_WALL: dict = {'N': ('y1', 'x'), 'S': ('y2', 'x'), 'E': ('x1', 'y'), 'W': ('x2', 'y')}
+
+# Spill files: leg count, then per leg its room count, its room records (see dungeonSerializer.ROOM), its bridge
+# count (0 or 1) and the bridge: x, y, w, h and its entrance and exit doors (relative x, y, direction)
+SPILL_COUNT = struct.Struct('<H')
+BRIDGE = struct.Struct('<iiiiiiciic')
+# Bumped whenever chunk contents or the spill format change, so older spill files are never read back
+SPILL_VERSION: int = 3
+
+
+def bridge_room(active: Door, target: Door):
+    # Returns a 'bridge' Room joining the active door (its entrance, door 0) to the target door (its exit, door 1),
+    # one unit from both like any connected room, or None if no rectangle within BRIDGE_REACH can
+    # Each door fixes the wall it docks onto; the free walls are pushed out just far enough to keep both doors
+    # BRIDGE_MARGIN from the corners
+    bounds = {}
+    along = {'x': [], 'y': []}
+    for door in (active, target):
+        bound, axis = DOCK_WALL[door.d]
+        gap_x, gap_y = DOOR_GAP[door.d]
+        value = door.x + gap_x if bound[0] == 'x' else door.y + gap_y
+        if bounds.setdefault(bound, value) != value:
+            return None
+        along[axis].append(door.x if axis == 'x' else door.y)
+    for axis in ('x', 'y'):
+        low = bounds.get(axis + '1')
+        high = bounds.get(axis + '2')
+        coordinates = along[axis]
+        if low is None:
+            low = min([c - BRIDGE_MARGIN for c in coordinates] + ([high - BRIDGE_MIN] if high is not None else []))
+        if high is None:
+            high = max([c + BRIDGE_MARGIN for c in coordinates] + [low + BRIDGE_MIN])
+        if not BRIDGE_MIN <= high - low <= BRIDGE_REACH:
+            return None
+        if any(not low + BRIDGE_MARGIN <= c <= high - BRIDGE_MARGIN for c in coordinates):
+            return None
+        bounds[axis + '1'] = low
+        bounds[axis + '2'] = high
+    x, y = bounds['x1'], bounds['y1']
+    w, h = bounds['x2'] - x, bounds['y2'] - y
+    doors = []
+    for door in (active, target):
+        side = OPPOSITE[door.d]
+        if side == 'S':
+            doors.append(Door(door.x - x, 0, 'S'))
+        elif side == 'N':
+            doors.append(Door(door.x - x, h, 'N'))
+        elif side == 'W':
+            doors.append(Door(0, door.y - y, 'W'))
+        else:
+            doors.append(Door(w, door.y - y, 'E'))
+    bridge = Room(x, y, w, h, 'bridge', doors)
+    bridge.entrance_i = 0
+    return bridge
+
+
+class Chunk:
+    # One square tile of the plane, in local coordinates (0 to chunk size - 1 on both axes)
+    # legs is a list of paths of (room, door): the first holds just the W portal room, every other one starts with
+    # its portal room and ends with a bridge room docked onto a door of an earlier leg, so all four portals connect
+    __slots__ = ('cx', 'cy', 'size', 'legs')
+
+    def __init__(self, cx: int, cy: int, size: int, legs: list):
+        self.cx = cx
+        self.cy = cy
+        self.size = size
+        self.legs = legs
+
+    @property
+    def origin(self):
+        # World coordinates of the chunk's (0, 0) corner
+        return self.cx * self.size, self.cy * self.size
+
+    def rooms(self):
+        # Yields every room of the chunk, in local coordinates
+        for leg in self.legs:
+            for room, door in leg:
+                yield room
+
+    def world_rooms(self):
+        # Yields (room, world x, world y) for every room of the chunk
+        origin_x, origin_y = self.origin
+        for room in self.rooms():
+            yield room, origin_x + room.x, origin_y + room.y
+
+
+class ChunkedDungeon:
+    # Unbounded dungeon split into chunk_size squares that are only generated when asked for
+    # Every shared chunk edge has one portal, placed from the seed and the edge alone, so neighbouring chunks agree
+    # on their connection whichever of them is generated first. Inside a chunk, legs are grown from the E, S and N
+    # portals by an ordinary DungeonGenerator (config with finish off and path_length leg_length), each heading for
+    # the nearest open door of the W portal and the legs before it and docking onto one with a bridge room, so
+    # every portal of a chunk is reachable from every other. A chunk with a leg that can't dock within
+    # leg_attempts is regrown from a new seed, up to chunk_retries times, then raises DungeonBuildError
+    # Chunks are kept in an LRU cache of cache_size entries; evicted chunks are written to spill_directory when
+    # one is given (and read back from there), otherwise they are regenerated, identically, when needed again
+    def __init__(self, seed, prefabs: list[Room], chunk_size: int = 500, cache_size: int = 64,
+                 spill_directory: str = None, leg_attempts: int = 2000, collision: str = 'index',
+                 scoring: str = 'auto', rotate: bool = True, config: GeneratorConfig = None,
+                 leg_length: int = LEG_LENGTH, chunk_retries: int = CHUNK_RETRIES):
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.leg_attempts = leg_attempts
+        self.chunk_retries = chunk_retries
+        start = PlacedRoom(PORTAL_PREFABS['W'], 0, chunk_size // 2 - 10, 1)
+        config = (config if config is not None else GeneratorConfig()).replace(path_length=leg_length, finish=False)
+        # The generator's grid is the usable area, so no room reaches the chunk's E or N edge
+        self.generator = DungeonGenerator(start, chunk_size - 1, chunk_size - 1, prefabs, collision=collision,
+                                          scoring=scoring, config=config)
+        if rotate:
+            self.generator.add_rotated_prefabs()
+        self.cache = OrderedDict()
+        self.spill_directory = spill_directory
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+        # Prefab ids used in spill files
+        self.table = tuple(PORTAL_PREFABS[side] for side in SIDES) + self.generator.catalog.prefabs
+        check_table(self.table)
+        self.ids = {id(room): i for i, room in enumerate(self.table)}
+        description = json.dumps({'seed': seed, 'chunk_size': chunk_size, 'leg_attempts': leg_attempts,
+                                  'chunk_retries': chunk_retries, 'version': SPILL_VERSION,
+                                  'params': generator_params(self.generator),
+                                  'catalog': catalog_hash(self.generator).hex()}, sort_keys=True, default=str)
+        self.key = hashlib.sha256(description.encode()).hexdigest()[:16]
+        # Cache hits, chunks generated, chunks read back from spill files and chunks evicted
+        self.hits = 0
+        self.generated = 0
+        self.loaded = 0
+        self.evicted = 0
+
+    def __len__(self):
+        # Number of chunks currently held in memory
+        return len(self.cache)
+
+    def portal(self, cx: int, cy: int, side: str):
+        # Returns the local (x, y) of the edge door of chunk (cx, cy)'s portal on side ('W', 'E', 'S' or 'N'), on the
+        # border of the usable area; the position along the edge depends only on the seed and the edge, and stays
+        # away from the corners
+        size = self.chunk_size
+        if side == 'W' or side == 'E':
+            edge = ('x', cx + (side == 'E'), cy)
+        else:
+            edge = ('y', cx, cy + (side == 'N'))
+        offset = random.Random(f'{self.seed}:{edge[0]}:{edge[1]}:{edge[2]}').randint(size // 4, 3 * size // 4)
+        if side == 'W':
+            return 0, offset
+        if side == 'E':
+            return size - 1, offset
+        if side == 'S':
+            return offset, 0
+        return offset, size - 1
+
+    def portal_room(self, cx: int, cy: int, side: str):
+        # Returns chunk (cx, cy)'s portal room on side, placed so its edge door lies on the portal
+        x, y = self.portal(cx, cy, side)
+        prefab = PORTAL_PREFABS[side]
+        edge_door = prefab.doors[1]
+        return PlacedRoom(prefab, x - edge_door.x, y - edge_door.y, 1)
+
+    def generate(self, cx: int, cy: int):
+        # Builds chunk (cx, cy) from scratch; the result depends only on the seed and the chunk coordinates
+        for attempt in range(self.chunk_retries):
+            legs = self.grow(cx, cy, attempt)
+            if legs is not None:
+                self.generated += 1
+                return Chunk(cx, cy, self.chunk_size, legs)
+        raise DungeonBuildError('Chunk ' + str((cx, cy)) + ' could not connect its portals in '
+                                + str(self.chunk_retries) + ' tries', 'attempts')
+
+    def grow(self, cx: int, cy: int, attempt: int):
+        # Grows the legs of chunk (cx, cy) from the attempt's seeds
+        # Returns the legs, or None if a leg ran out of budget before it could dock
+        g = self.generator
+        portals = [self.portal_room(cx, cy, side) for side in SIDES]
+        legs = [[(portals[0], portals[0].get_door(0))]]
+        # Doors already joined to another room (the portals' edge doors join the neighbouring chunks)
+        used = {portal.get_door(1) for portal in portals}
+        for side, portal in zip(SIDES[1:], portals[1:]):
+            targets = [room.get_door(i) for leg in legs for room, door in leg for i in range(len(room.doors))]
+            targets = [door for door in targets if door not in used]
+            g.rng = random.Random(f'{self.seed}:{cx}:{cy}:{attempt}:{side}')
+            g.reset_path(portal)
+            # The other portals and earlier legs are collision obstacles only, never part of this leg's path
+            for room in portals:
+                if room is not portal:
+                    g.index.add(room)
+            for leg in legs[1:]:
+                for room, door in leg[1:]:
+                    g.index.add(room)
+            entrance = portal.get_door(0)
+            nearest = min(targets, key=lambda door: (door.x - entrance.x) ** 2 + (door.y - entrance.y) ** 2)
+            g.target = (nearest.x, nearest.y)
+            docked = self.dock(g, targets)
+            try:
+                if docked is None:
+                    for event in g.iter_build(max_attempts=self.leg_attempts):
+                        if event.kind == 'place':
+                            docked = self.dock(g, targets)
+                            if docked is not None:
+                                break
+            except DungeonBuildError:
+                return None
+            if docked is None:
+                return None
+            bridge, target = docked
+            leg = list(g.path) + [(bridge, bridge.get_door(1))]
+            for room, door in leg:
+                used.add(room.get_door(room.entrance_i))
+                used.add(door)
+            used.add(target)
+            legs.append(leg)
+        return legs
+
+    def dock(self, g: DungeonGenerator, targets: list[Door]):
+        # Returns (bridge room, target door) joining the exit of g's last room to the closest of the targets a
+        # bridge room fits in free space, or None if it fits none of them
+        active = g.path[-1][1]
+        for target in sorted(targets, key=lambda door: abs(door.x - active.x) + abs(door.y - active.y)):
+            bridge = bridge_room(active, target)
+            if bridge is not None and g.in_grid(bridge) and not g.index.hits(bridge):
+                return bridge, target
+        return None
+
+    def chunk(self, cx: int, cy: int):
+        # Returns chunk (cx, cy), generating (or reading back) it on a cache miss and evicting the coldest chunk
+        # when the cache is full
+        key = (cx, cy)
+        chunk = self.cache.get(key)
+        if chunk is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return chunk
+        chunk = self.load(cx, cy)
+        if chunk is None:
+            chunk = self.generate(cx, cy)
+        self.cache[key] = chunk
+        while len(self.cache) > self.cache_size:
+            self.evict()
+        return chunk
+
+    def chunk_at(self, x: int, y: int):
+        # Returns the chunk containing world point (x, y)
+        return self.chunk(x // self.chunk_size, y // self.chunk_size)
+
+    def rooms_in(self, x0: int, y0: int, x1: int, y1: int):
+        # Yields (room, world x, world y) for every room of the chunks overlapping the world rectangle (x0, y0) to
+        # (x1, y1), e.g. a viewer's window; chunks outside it are never generated
+        size = self.chunk_size
+        for cy in range(y0 // size, y1 // size + 1):
+            for cx in range(x0 // size, x1 // size + 1):
+                yield from self.chunk(cx, cy).world_rooms()
+
+    def evict(self):
+        # Drops the least recently used chunk, spilling it to disk first when a spill directory is set
+        (cx, cy), chunk = self.cache.popitem(last=False)
+        self.evicted += 1
+        if self.spill_directory is not None and not os.path.exists(self.filename(cx, cy)):
+            self.spill(chunk)
+
+    def filename(self, cx: int, cy: int):
+        return os.path.join(self.spill_directory, f'{self.key}_{cx}_{cy}.chunk')
+
+    def spill(self, chunk: Chunk):
+        # Writes a chunk to its spill file
+        output = bytearray(SPILL_COUNT.pack(len(chunk.legs)))
+        for leg in chunk.legs:
+            # Bridges are the only rooms that aren't placed prefabs
+            bridges = [room for room, door in leg if not isinstance(room, PlacedRoom)]
+            records = room_records(leg[:len(leg) - len(bridges)], self.ids)
+            output += SPILL_COUNT.pack(len(records))
+            for record in records:
+                output += ROOM.pack(*record)
+            output += SPILL_COUNT.pack(len(bridges))
+            for bridge in bridges:
+                entrance, exit_door = bridge.doors
+                output += BRIDGE.pack(bridge.x, bridge.y, bridge.w, bridge.h, entrance.x, entrance.y,
+                                      entrance.d.encode(), exit_door.x, exit_door.y, exit_door.d.encode())
+        filename = self.filename(chunk.cx, chunk.cy)
+        temporary = filename + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(output)
+        os.replace(temporary, filename)
+
+    def load(self, cx: int, cy: int):
+        # Returns chunk (cx, cy) from its spill file, or None if it was never spilled
+        if self.spill_directory is None:
+            return None
+        try:
+            with open(self.filename(cx, cy), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        position = 0
+        leg_count, = SPILL_COUNT.unpack_from(data, position)
+        position += SPILL_COUNT.size
+        legs = []
+        for i in range(leg_count):
+            count, = SPILL_COUNT.unpack_from(data, position)
+            position += SPILL_COUNT.size
+            leg = []
+            for j in range(count):
+                prefab_id, x, y, entrance_i, exit_i = ROOM.unpack_from(data, position)
+                position += ROOM.size
+                room = PlacedRoom(self.table[prefab_id], x, y, entrance_i)
+                leg.append((room, room.get_door(exit_i) if exit_i >= 0 else None))
+            count, = SPILL_COUNT.unpack_from(data, position)
+            position += SPILL_COUNT.size
+            for j in range(count):
+                x, y, w, h, entrance_x, entrance_y, entrance_d, exit_x, exit_y, exit_d = \
+                    BRIDGE.unpack_from(data, position)
+                position += BRIDGE.size
+                bridge = Room(x, y, w, h, 'bridge', [Door(entrance_x, entrance_y, entrance_d.decode()),
+                                                     Door(exit_x, exit_y, exit_d.decode())])
+                bridge.entrance_i = 0
+                leg.append((bridge, bridge.get_door(1)))
+            legs.append(leg)
+        self.loaded += 1
+        return Chunk(cx, cy, self.chunk_size, legs)
@@ -1,18 +1,26 @@
 from __future__ import annotations
-import pygame
 import sys
 import random
 import math
-import copy
 import time
+import dataclasses
+
+# pygame and numpy are imported on first use (see load_pygame/load_numpy) so the generator core imports headless
+pygame = None
+np = None
 
 
 # Dungeon Generator Parameters
+# Defaults of GeneratorConfig, read once at import: generators only ever use their own config
 FINISH_THRESH: float = .3
 ROOM_RANDOM: float = .7
 DOOR_RANDOM: float = .65
 PATH_LENGTH: int = 15
 ALLOWED_FAILS: int = 3
+# Build budget: placement attempts per build, restarts within those attempts and an optional wall-clock limit (s)
+MAX_ATTEMPTS: int = 20000
+MAX_RESTARTS: int = 3
+BUILD_DEADLINE: float = None
 
 # Global Colors
 RED: tuple = (255, 0, 0)
@@ -27,34 +35,89 @@ PINK: tuple = (252, 3, 223)
 
 ROOM_EDGE_COLOR = ORANGE
 DOOR_COLOR = BLUE
+# Frame rate cap of PygameDisplay.on
+DISPLAY_FPS: int = 30
 
 
 # Helper Functions / Objects
 
-def log(message: str, key: str):
-    # A function that will print the inputted debugging message if the key's debug type is set to true
-    types: dict = {
-        'converting': False,
-        'add room': False,
-        'add line': False,
-        'place room': False,
-        'generate finish': False,
-        'overlap': False,
-        'build dungeon': False,
-        'rotated prefabs': False,
-        'random door': False ,
-        'True': True,
-        'False': False
-    }
-
-    if types[key]:
-        print(message)
+def load_pygame():
+    # Imports pygame the first time a display needs it and returns the module
+    global pygame
+    if pygame is None:
+        import pygame as module
+        pygame = module
+    return pygame
+
+
+def load_numpy():
+    # Imports numpy the first time a backend needs it and returns the module
+    global np
+    if np is None:
+        try:
+            import numpy as module
+        except ImportError:
+            raise ImportError('This feature requires numpy') from None
+        np = module
+    return np
+
+# Debug categories, all off by default
+LOG_CATEGORIES: tuple = ('converting', 'add_room', 'add_line', 'place_room', 'generate_finish', 'overlap',
+                         'build_dungeon', 'rotated_prefabs', 'random_door')
+
+
+class LogSwitches:
+    # One switch per debug category, read by the guards around every log call:
+    #     if __debug__ and LOG.build_dungeon:
+    #         log('build_dungeon', 'Active room: %s', active_room.name)
+    # A disabled category costs one attribute read, and python -O compiles the guarded calls away entirely
+    __slots__ = LOG_CATEGORIES
+
+    def __init__(self):
+        for key in LOG_CATEGORIES:
+            setattr(self, key, False)
+
+
+LOG = LogSwitches()
+# Optional callable receiving a dict per log event instead of the event being printed
+log_sink = None
+
+
+def configure_logging(*keys: str, sink=None):
+    # Enables exactly the given debug categories (disabling the rest) and sets the event sink
+    global log_sink
+    for key in keys:
+        if key not in LOG_CATEGORIES:
+            raise ValueError('Unknown log category: ' + str(key))
+    for key in LOG_CATEGORIES:
+        setattr(LOG, key, key in keys)
+    log_sink = sink
+
+
+def log(key: str, message: str, *args):
+    # Emits a debugging message for the key's category, formatting message % args only now
+    # Callers check the category first, so nothing is built for disabled categories
+    if log_sink is not None:
+        log_sink({'time': time.perf_counter(), 'category': key, 'message': message, 'args': args})
+    else:
+        print(message % args if args else message)
+
+
+def room_color(room: Room):
+    # Returns the fill color a room is drawn with
+    if room.name == 'start':
+        return GREEN
+    elif room.name == 'finish':
+        return RED
+    return YELLOW
 
 
 class PygameDisplay:
     # A bordered pygame window with (0, 0) in bottom left rather than top left (pygame default)
+    # offscreen=True draws onto a plain pygame.Surface instead, with no window, for saving images headless
+    # Drawing only marks rectangles dirty; update() pushes them to the window
     def __init__(self, innerWidth: int, innerHeight: int, borderThickness: int, backgroundColor: tuple,
-                 borderColor: tuple):
+                 borderColor: tuple, offscreen: bool = False):
         self.innerWidth = innerWidth
         self.innerHeight = innerHeight
         self.windowWidth = innerWidth + (2 * borderThickness)
@@ -62,13 +125,22 @@ class PygameDisplay:
         self.borderThickness = borderThickness
         self.backgroundColor = backgroundColor
         self.borderColor = borderColor
-        pygame.init()
-        self.screen = pygame.display.set_mode((self.windowWidth, self.windowHeight))
-        pygame.display.set_caption("Dungeon Generator")
+        self.offscreen = offscreen
+        self.dirty = []
+        load_pygame()
+        if offscreen:
+            self.screen = pygame.Surface((self.windowWidth, self.windowHeight))
+        else:
+            pygame.init()
+            self.screen = pygame.display.set_mode((self.windowWidth, self.windowHeight))
+            pygame.display.set_caption("Dungeon Generator")
         self.screen.fill(self.borderColor)
         pygame.draw.rect(self.screen, self.backgroundColor, (self.borderThickness, self.borderThickness,
                                                              self.windowWidth - 2 * self.borderThickness,
                                                              self.windowHeight - 2 * self.borderThickness))
+        if not offscreen:
+            # The border and background are never marked dirty, so they reach the window with one full update
+            pygame.display.update()
 
     def reset(self):
         # Reinitialized the pygame window for successive use
@@ -76,19 +148,31 @@ class PygameDisplay:
         pygame.draw.rect(self.screen, self.backgroundColor, (self.borderThickness, self.borderThickness,
                                                              self.windowWidth - 2 * self.borderThickness,
                                                              self.windowHeight - 2 * self.borderThickness))
-        pygame.display.update()
+        self.dirty = []
+        if not self.offscreen:
+            pygame.display.update()
+
+    def update(self):
+        # Pushes the rectangles drawn since the last update to the window
+        if self.dirty and not self.offscreen:
+            pygame.display.update(self.dirty)
+        self.dirty = []
 
     def real(self, point: tuple, y_offset: int = 0):
         # Converts ordered pair from bottom-left-origin (input) to top-left-origin (for pygame built-in functions)
         x = point[0]
         y = point[1]
-        log('Converting ' + str(x) + ', ' + str(y), 'converting')
+        if __debug__ and LOG.converting:
+            log('converting', 'Converting %s, %s', x, y)
         real_x = x + self.borderThickness
         real_y = self.windowHeight - (y + self.borderThickness + y_offset)
         return real_x, real_y
 
     def on(self, seconds: int = 100000):
         # Displays the pygame window for a specified amount of time
+        # The loop is capped at DISPLAY_FPS frames a second and only redraws dirty rectangles, so it sleeps
+        # between frames instead of spinning
+        clock = pygame.time.Clock()
         start_time = time.time()
         time_dif = 0
         while time_dif <= seconds:
@@ -102,16 +186,19 @@ class PygameDisplay:
             current_time = time.time()
             time_dif = current_time - start_time
 
-            pygame.display.update()
+            self.update()
+            clock.tick(DISPLAY_FPS)
 
     def add_room(self, room: Room, color: tuple):
         # Draws a colored rectangle on pygame window, with smaller rectangles at the relative door locations
-        log(room.name, 'add room')
-        log('room_x: ' + str(room.x), 'add room')
-        log('room_y: ' + str(room.y), 'add room')
+        if __debug__ and LOG.add_room:
+            log('add_room', '%s', room.name)
+            log('add_room', 'room_x: %s', room.x)
+            log('add_room', 'room_y: %s', room.y)
         real_x, real_y = self.real((room.x, room.y), room.h)
-        log('real_x: ' + str(real_x), 'add room')
-        log('real_y: ' + str(real_y), 'add room')
+        if __debug__ and LOG.add_room:
+            log('add_room', 'real_x: %s', real_x)
+            log('add_room', 'real_y: %s', real_y)
 
         pygame.draw.rect(self.screen, ROOM_EDGE_COLOR, (real_x, real_y, room.w, room.h))
         pygame.draw.rect(self.screen, color, (real_x + 2, real_y + 2, room.w - 4, room.h - 4))
@@ -134,15 +221,37 @@ class PygameDisplay:
 
             pygame.draw.rect(self.screen, DOOR_COLOR,
                              (real_x + door.x + x_offset, real_y - door.y + room.h + y_offset, 4, 4))
-        pygame.display.update()
+        self.dirty.append(pygame.Rect(real_x, real_y, room.w, room.h))
+
+    def remove_room(self, room: Room):
+        # Paints over a drawn room with the background color
+        real_x, real_y = self.real((room.x, room.y), room.h)
+        self.dirty.append(pygame.draw.rect(self.screen, self.backgroundColor, (real_x, real_y, room.w, room.h)))
+
+    def draw_path(self, path: list, goal: tuple = None):
+        # Draws every room of a path (and the goal marker) in one pass, without pushing anything to the window
+        for room, door in path:
+            self.add_room(room, room_color(room))
+        if goal is not None:
+            self.add_room(Room(goal[0], goal[1], 10, 10, 'goal'), PINK)
+
+    def save(self, filename: str):
+        # Saves the current picture, the format follows the file extension (e.g. .png)
+        pygame.image.save(self.screen, filename)
+
+    def to_array(self):
+        # Returns the current picture as a (windowHeight, windowWidth, 3) uint8 numpy RGB array
+        load_numpy()
+        return pygame.surfarray.array3d(self.screen).swapaxes(0, 1)
 
     def add_line(self, point1: tuple, point2: tuple, color: tuple):
         # Draws a colored line on the pygame window
         real1 = self.real(point1)
         real2 = self.real(point2)
-        log('Line Start: ' + str(point1), 'add line')
-        log('Line End: ' + str(point2), 'add line')
-        pygame.draw.line(self.screen, color, real1, real2, 2)
+        if __debug__ and LOG.add_line:
+            log('add_line', 'Line Start: %s', point1)
+            log('add_line', 'Line End: %s', point2)
+        self.dirty.append(pygame.draw.line(self.screen, color, real1, real2, 2))
 
     def print(self):
         # Prints details of the pygame window to console
@@ -153,7 +262,24 @@ class PygameDisplay:
         print('BorderThickness: ' + str(self.borderThickness))
 
 
+def save_path_images(paths: list, filename_pattern: str, innerWidth: int, innerHeight: int,
+                     borderThickness: int = 10, goals: list = None):
+    # Renders many paths offscreen and saves one image per path as filename_pattern.format(i), e.g. 'dungeon_{}.png'
+    # One Surface is reused for every image; returns the file names
+    window = PygameDisplay(innerWidth, innerHeight, borderThickness, BLACK, WHITE, offscreen=True)
+    filenames = []
+    for i, path in enumerate(paths):
+        window.reset()
+        window.draw_path(path, goals[i] if goals is not None else None)
+        filename = filename_pattern.format(i)
+        window.save(filename)
+        filenames.append(filename)
+    return filenames
+
+
 class Door:
+    __slots__ = ('x', 'y', 'd')
+
     def __init__(self, relative_x: int, relative_y: int, direction: str):
         self.x = relative_x
         self.y = relative_y
@@ -163,6 +289,9 @@ class Door:
         if self.x == other.x and self.y == other.y and self.d == other.d:
             return True
 
+    def __hash__(self):
+        return hash((self.x, self.y, self.d))
+
     def __str__(self):
         return f'({self.x}, {self.y}, {self.d})'
 
@@ -202,6 +331,15 @@ class Room:
         else:
             return False
 
+    def __hash__(self):
+        # Consistent with __eq__, which ignores position and name
+        return hash(self.shape_key())
+
+    def shape_key(self):
+        # Returns (w, h, door count, sorted distinct doors), equal for exactly the rooms __eq__ considers equal both
+        # ways round (the count keeps [A, B] and [A, A, B] apart, as __eq__ does)
+        return self.w, self.h, len(self.doors), tuple(sorted({(door.x, door.y, door.d) for door in self.doors}))
+
     def get_door(self, index: int):
         # Returns relative x, y and direction of the indexed door
         x = self.x + self.doors[index].x
@@ -261,7 +399,7 @@ class Room:
                 dist = math.sqrt((goal[0] - door.x) ** 2 + (goal[1] - door.y) ** 2)
                 if dist < best_distance:
                     best_distance = dist
-                    best_door = self.get_door(d)
+                    best_door = door
         return best_door
 
     def place_room(self, active_door: Door, entrance: Door):
@@ -281,7 +419,8 @@ class Room:
         self.x = active_door.x - entrance.x + x_offset
         self.y = active_door.y - entrance.y + y_offset
         self.entrance_i = self.doors.index(entrance)
-        log('Room placed at ' + str(self.x) + ', ' + str(self.y), 'place room')
+        if __debug__ and LOG.place_room:
+            log('place_room', 'Room placed at %s, %s', self.x, self.y)
 
     def get_edges(self):
         # Returns a list of dicts, with the slope (0 or inf), the x/y value (depends on slope) and the endpoints
@@ -323,51 +462,744 @@ class Room:
     def get_rotated(self, degree: int):
         # Returns a copy of the room that has been rotated degree degrees
         # Only called on unplaced rooms
-        directions = ['N', 'E', 'S', 'W', 'N']
+        # Turns a quarter at a time, at least once (so the name gains one ' r90' per quarter turn)
+        next_direction = {'N': 'E', 'E': 'S', 'S': 'W', 'W': 'N'}
 
-        new_w = self.h
-        new_h = self.w
-        new_name = self.name + ' r90'
+        w = self.w
+        h = self.h
+        name = self.name
+        doors = [(door.x, door.y, door.d) for door in self.doors]
+        for i in range(max(-(-degree // 90), 1)):
+            doors = [(y, w - x, next_direction[d]) for x, y, d in doors]
+            w, h = h, w
+            name += ' r90'
 
-        new_doors = []
-        for door in self.doors:
-            new_doors.append(Door(door.y, self.w - door.x, directions[directions.index(door.d) + 1]))
+        return Room(0, 0, w, h, name, [Door(x, y, d) for x, y, d in doors])
 
-        output = Room(0, 0, new_w, new_h, new_name, new_doors)
 
-        if degree > 90:
-            degree -= 90
-            output = output.get_rotated(degree)
+class PlacedRoom:
+    # A room in a dungeon path: a reference to its shared prefab plus where it was placed
+    # The prefab is never copied or modified, door world positions are computed on demand
+    __slots__ = ('prefab', 'x', 'y', 'entrance_i')
 
-        return output
+    def __init__(self, prefab: Room, x: int, y: int, entrance_i: int):
+        self.prefab = prefab
+        self.x = x
+        self.y = y
+        self.entrance_i = entrance_i
+
+    @property
+    def name(self):
+        return self.prefab.name
+
+    @property
+    def w(self):
+        return self.prefab.w
+
+    @property
+    def h(self):
+        return self.prefab.h
+
+    @property
+    def doors(self):
+        return self.prefab.doors
+
+    # Placed rooms answer the same position queries as a Room placed with Room.place_room
+    get_door = Room.get_door
+    get_directions = Room.get_directions
+    get_door_by_d = Room.get_door_by_d
+    get_best_door = Room.get_best_door
+    get_edges = Room.get_edges
+
+
+def rotated_prefabs(prefabs: list[Room]):
+    # Returns a new list of the prefabs followed by every rotation of them that isn't equal to a room already in it
+    # Rooms are compared by shape key in a set, so this is linear in the number of prefabs; prefabs isn't modified
+    full_prefabs = list(prefabs)
+    shapes = {room.shape_key() for room in full_prefabs}
+
+    for room in prefabs:
+        for degree in [90, 180, 270]:
+            rotated_room = room.get_rotated(degree)
+            shape = rotated_room.shape_key()
+            if shape not in shapes:
+                shapes.add(shape)
+                full_prefabs.append(rotated_room)
+                if __debug__ and LOG.rotated_prefabs:
+                    log('rotated_prefabs', 'Adding rotated room %s', rotated_room.name)
+
+    return full_prefabs
+
+
+# Direction an entrance must face to connect to an active door facing the key direction
+OPPOSITE: dict = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
+# One-unit gap left between an active door and the entrance of the room placed on it
+DOOR_GAP: dict = {'N': (0, 1), 'S': (0, -1), 'E': (1, 0), 'W': (-1, 0)}
+
+
+class PrefabCandidate:
+    # A prefab resolved for one active door direction: its entrance door and every exit door's position
+    # relative to the active door, so scoring and placement never search the door list
+    __slots__ = ('room', 'entrance_i', 'entrance', 'offset_x', 'offset_y', 'exits', 'exit_doors')
+
+    def __init__(self, room: Room, entrance_i: int, active_d: str):
+        self.room = room
+        self.entrance_i = entrance_i
+        self.entrance = room.doors[entrance_i]
+        gap_x, gap_y = DOOR_GAP[active_d]
+        # Room origin relative to the active door once placed (matches Room.place_room)
+        self.offset_x = gap_x - self.entrance.x
+        self.offset_y = gap_y - self.entrance.y
+        # Indices into room.doors of the exits, and their offsets from the active door
+        self.exit_doors = tuple(i for i, door in enumerate(room.doors) if door != self.entrance)
+        self.exits = tuple((self.offset_x + room.doors[i].x, self.offset_y + room.doors[i].y) for i in self.exit_doors)
+
+    def test_distance(self, active_door: Door, goal: tuple):
+        # Same as Room.test_distance, using the precomputed exit offsets
+        # A room with no exits is never the best choice
+        distances = [math.sqrt((goal[0] - active_door.x - x) ** 2 + (goal[1] - active_door.y - y) ** 2)
+                     for x, y in self.exits]
+        return max(distances, default=math.inf)
+
+    def best_exit(self, active_door: Door, goal: tuple, field: DistanceField = None):
+        # Same as Room.get_best_door once placed, but returns the index into room.doors of the exit closest to goal
+        # (by field's score instead of straight-line distance when a DistanceField is given)
+        best_distance = math.inf
+        best_i = -1
+        for i, (x, y) in zip(self.exit_doors, self.exits):
+            if field is not None:
+                dist = field.score(active_door.x + x, active_door.y + y, goal, refresh=False)
+                if best_i == -1 and dist == math.inf:
+                    # Keeps some exit even when none can reach the goal
+                    best_i = i
+            else:
+                dist = math.sqrt((goal[0] - active_door.x - x) ** 2 + (goal[1] - active_door.y - y) ** 2)
+            if dist < best_distance:
+                best_distance = dist
+                best_i = i
+        if field is not None and not field.exact(best_distance):
+            # The pending rooms might change the answer, so it is worked out again on the refreshed field
+            field.refresh()
+            return self.best_exit(active_door, goal, field)
+        return best_i
+
+
+class PrefabCatalog:
+    # Immutable lookup from an active door's direction to the prefabs that can connect to it
+    # Compiled once from a prefab list; candidates keep the prefab list's order
+    def __init__(self, prefabs: list[Room]):
+        self.prefabs = tuple(prefabs)
+        by_direction = {}
+        for active_d, entrance_d in OPPOSITE.items():
+            candidates = []
+            for room in self.prefabs:
+                for i, door in enumerate(room.doors):
+                    if door.d == entrance_d:
+                        candidates.append(PrefabCandidate(room, i, active_d))
+                        break
+            by_direction[active_d] = tuple(candidates)
+        self.by_direction = by_direction
+        # Numpy exit offset matrices per direction, built on first vectorized rank
+        self.name_ids = {}
+        self.arrays = {}
+
+    def candidates(self, active_d: str):
+        # Returns the candidates whose entrance connects to a door facing active_d
+        return self.by_direction.get(active_d, ())
+
+    def vector_data(self, active_d: str):
+        # Returns (exit offsets, exit mask, name ids) for the candidates of active_d
+        # Exit offsets are a (candidates, most exits, 2) float matrix, the mask marks which entries are real exits
+        data = self.arrays.get(active_d)
+        if data is None:
+            candidates = self.candidates(active_d)
+            width = max([len(candidate.exits) for candidate in candidates] + [1])
+            exits = np.zeros((len(candidates), width, 2))
+            mask = np.zeros((len(candidates), width), dtype=bool)
+            names = np.zeros(len(candidates), dtype=np.int64)
+            for i, candidate in enumerate(candidates):
+                exits[i, :len(candidate.exits)] = candidate.exits
+                mask[i, :len(candidate.exits)] = True
+                names[i] = self.name_ids.setdefault(candidate.room.name, len(self.name_ids))
+            data = (exits, mask, names)
+            self.arrays[active_d] = data
+        return data
+
+    def rank(self, active_door: Door, goal: tuple, exclude: set = (), vector: bool = False,
+             field: DistanceField = None):
+        # Scores every candidate for active_door by test_distance, skipping prefabs whose name is in exclude
+        # Returns (indices of the available candidates, index of the best one or -1)
+        # vector=True scores all candidates' exits in one numpy operation (requires numpy to be loaded)
+        # With a DistanceField, candidates are instead scored (always vectorized) by their best exit's field score,
+        # so rooms whose exits face placed rooms or grid edges rank last
+        candidates = self.candidates(active_door.d)
+        if (vector or field is not None) and candidates:
+            exits, mask, names = self.vector_data(active_door.d)
+            excluded = [self.name_ids[name] for name in exclude if name in self.name_ids]
+            available = np.flatnonzero(~np.isin(names, excluded)) if excluded else np.arange(len(names))
+            if len(available) == 0:
+                return available, -1
+            if field is not None:
+                xs = active_door.x + exits[:, :, 0]
+                ys = active_door.y + exits[:, :, 1]
+                distances = np.where(mask, field.scores(xs, ys, goal, refresh=False), np.inf).min(axis=1)
+            else:
+                dx = (goal[0] - active_door.x) - exits[:, :, 0]
+                dy = (goal[1] - active_door.y) - exits[:, :, 1]
+                distances = np.where(mask, np.sqrt(dx * dx + dy * dy), -np.inf).max(axis=1)
+                distances[~mask.any(axis=1)] = np.inf
+            # argmin keeps the first of equal distances, like the scalar scan
+            best = int(available[np.argmin(distances[available])])
+            if field is not None and not field.exact(distances[best]):
+                # The pending rooms might change the winner, so it is picked again on the refreshed field
+                field.refresh()
+                distances = np.where(mask, field.scores(xs, ys, goal), np.inf).min(axis=1)
+                best = int(available[np.argmin(distances[available])])
+            return available, best
+
+        available = [i for i, candidate in enumerate(candidates) if candidate.room.name not in exclude]
+        best_distance = math.inf
+        best = -1
+        for i in available:
+            dist = candidates[i].test_distance(active_door, goal)
+            if __debug__ and LOG.build_dungeon:
+                log('build_dungeon', '%s: %s', candidates[i].room.name, dist)
+            if dist < best_distance:
+                best_distance = dist
+                best = i
+        return available, best
+
+
+# Prefab libraries at least this large are scored with numpy when scoring='auto'
+VECTOR_SCORING_MIN: int = 64
+
+
+# Room every path ends with, forced once the path reaches the config's path_length (unless its finish is off)
+FINISH_PREFAB = Room(0, 0, 20, 20, 'finish',
+                     [Door(10, 0, 'S'), Door(10, 20, 'N'), Door(0, 10, 'W'), Door(20, 10, 'E')])
+FINISH_CATALOG = PrefabCatalog([FINISH_PREFAB])
+
+
+class SpatialIndex:
+    # Uniform bucket grid over the rectangles of placed rooms
+    # Each room is filed under every bucket its rectangle touches, so a query only looks at nearby rooms
+    def __init__(self, bucket_size: int = 64):
+        self.bucket_size = bucket_size
+        self.buckets: dict = {}
+        # Running count of rectangle comparisons made by hits
+        self.comparisons = 0
+
+    def cells(self, x: int, y: int, w: int, h: int):
+        # Yields the (column, row) of every bucket touched by the closed rectangle
+        size = self.bucket_size
+        for cx in range(x // size, (x + w) // size + 1):
+            for cy in range(y // size, (y + h) // size + 1):
+                yield cx, cy
+
+    def add(self, room: Room):
+        # Files a placed room under its buckets (rooms are keyed by identity since Room.__eq__ ignores position)
+        for cell in self.cells(room.x, room.y, room.w, room.h):
+            self.buckets.setdefault(cell, {})[id(room)] = room
+
+    def remove(self, room: Room):
+        # Removes a placed room from its buckets, dropping buckets that become empty
+        for cell in self.cells(room.x, room.y, room.w, room.h):
+            bucket = self.buckets.get(cell)
+            if bucket is not None:
+                bucket.pop(id(room), None)
+                if not bucket:
+                    del self.buckets[cell]
+
+    def clear(self):
+        self.buckets = {}
+
+    def hits(self, test_room: Room):
+        # Returns true if the closed rectangle of test_room touches any indexed room
+        # Covers edge crossings as well as one room fully containing the other
+        x1 = test_room.x
+        y1 = test_room.y
+        x2 = x1 + test_room.w
+        y2 = y1 + test_room.h
+        for cell in self.cells(x1, y1, test_room.w, test_room.h):
+            bucket = self.buckets.get(cell)
+            if bucket:
+                self.comparisons += len(bucket)
+                for room in bucket.values():
+                    if room.x <= x2 and x1 <= room.x + room.w and room.y <= y2 and y1 <= room.y + room.h:
+                        return True
+        return False
+
+
+class OccupancyGrid:
+    # NumPy occupancy bitmap of the grid, an alternative to SpatialIndex with the same add/remove/clear/hits interface
+    # Rooms are closed rectangles, so a room at x with width w covers the lattice points x through x + w
+    # hits scans the test room's window of the bitmap, so it costs O(w * h) however many rooms are placed
+    def __init__(self, grid_w: int, grid_h: int):
+        load_numpy()
+        self.grid_w = grid_w
+        self.grid_h = grid_h
+        # Counts rather than booleans so popping a room never clears cells still covered by another room
+        self.counts = np.zeros((grid_w + 1, grid_h + 1), dtype=np.uint16)
+        # Running count of hits queries, each one window scan
+        self.comparisons = 0
+
+    def window(self, room: Room):
+        # Returns the inclusive lattice bounds of the room clipped to the grid
+        x1 = max(room.x, 0)
+        y1 = max(room.y, 0)
+        x2 = min(room.x + room.w, self.grid_w)
+        y2 = min(room.y + room.h, self.grid_h)
+        return x1, y1, x2, y2
+
+    def add(self, room: Room):
+        x1, y1, x2, y2 = self.window(room)
+        self.counts[x1:x2 + 1, y1:y2 + 1] += 1
+
+    def remove(self, room: Room):
+        x1, y1, x2, y2 = self.window(room)
+        self.counts[x1:x2 + 1, y1:y2 + 1] -= 1
+
+    def clear(self):
+        self.counts.fill(0)
+
+    def hits(self, test_room: Room):
+        # Returns true if the closed rectangle of test_room covers any occupied lattice point
+        x1, y1, x2, y2 = self.window(test_room)
+        if x1 > x2 or y1 > y2:
+            return False
+        self.comparisons += 1
+        return bool(self.counts[x1:x2 + 1, y1:y2 + 1].any())
+
+
+class DistanceField:
+    # Coarse breadth-first distance field towards the goal over free space, for DungeonGenerator(heuristic='field')
+    # The grid is cut into cell_size squares; a cell is blocked when its center lies in a placed room (rooms never
+    # overlap, so counts only guard against callers that add a room twice). field holds every cell's step count to
+    # the goal's cell, UNREACHABLE for cells walled off from it, with a border of UNREACHABLE padding
+    # Added and removed rooms are only applied by refresh, and then only around those rooms. Rankings first read
+    # the field as it stands and skip the refresh when the pending rooms can't change their answer (see exact), so
+    # while a path grows towards the goal most placements never pay for one
+    UNREACHABLE = 2 ** 30
+
+    def __init__(self, grid_w: int, grid_h: int, cell_size: int = 10):
+        load_numpy()
+        self.grid_w = grid_w
+        self.grid_h = grid_h
+        self.cell_size = cell_size
+        self.cols = grid_w // cell_size + 1
+        self.rows = grid_h // cell_size + 1
+        self.counts = np.zeros((self.cols, self.rows), dtype=np.uint16)
+        self.field = np.full((self.cols + 2, self.rows + 2), self.UNREACHABLE, dtype=np.int32)
+        self.goal = None
+        # Cell windows of the rooms added and removed since the field was last refreshed, and the smallest step
+        # count the added windows cover
+        self.added = []
+        self.removed = []
+        self.settled = self.UNREACHABLE
+        # Running count of cells recomputed, like the collision backends' comparisons
+        self.updates = 0
+
+    def cell(self, x: float, y: float):
+        # Returns the (column, row) of the cell containing the point, clipped to the grid
+        return (min(max(int(x // self.cell_size), 0), self.cols - 1),
+                min(max(int(y // self.cell_size), 0), self.rows - 1))
+
+    def window(self, room: Room):
+        # Returns the cell bounds (x1, x2, y1, y2), end exclusive, of the cells whose centers lie in the room
+        size = self.cell_size
+        half = size / 2
+        x1 = max(math.ceil((room.x - half) / size), 0)
+        x2 = min(math.floor((room.x + room.w - half) / size) + 1, self.cols)
+        y1 = max(math.ceil((room.y - half) / size), 0)
+        y2 = min(math.floor((room.y + room.h - half) / size) + 1, self.rows)
+        return x1, x2, y1, y2
+
+    def set_goal(self, goal: tuple):
+        # Recomputes the whole field for a new goal
+        self.goal = self.cell(goal[0], goal[1])
+        self.added = []
+        self.removed = []
+        self.settled = self.UNREACHABLE
+        self.field.fill(self.UNREACHABLE)
+        gx, gy = self.goal
+        self.field[gx + 1, gy + 1] = 0
+        self.relax(gx, gx + 1, gy, gy + 1)
+
+    def clear(self):
+        self.counts.fill(0)
+        self.goal = None
+        self.added = []
+        self.removed = []
+        self.settled = self.UNREACHABLE
+        self.field.fill(self.UNREACHABLE)
+
+    def add(self, room: Room):
+        x1, x2, y1, y2 = self.window(room)
+        if x1 < x2 and y1 < y2:
+            self.counts[x1:x2, y1:y2] += 1
+            if self.goal is not None:
+                self.added.append((x1, x2, y1, y2))
+                self.settled = min(self.settled, int(self.field[x1 + 1:x2 + 1, y1 + 1:y2 + 1].min()))
+
+    def remove(self, room: Room):
+        x1, x2, y1, y2 = self.window(room)
+        if x1 < x2 and y1 < y2:
+            self.counts[x1:x2, y1:y2] -= 1
+            if self.goal is not None:
+                window = (x1, x2, y1, y2)
+                if window in self.added:
+                    # Still pending, so the two cancel out (settled only ever errs low)
+                    del self.added[len(self.added) - 1 - self.added[::-1].index(window)]
+                else:
+                    self.removed.append(window)
+
+    def refresh(self):
+        # Updates the field for the rooms added and removed since the last refresh
+        # Newly blocked cells can only lengthen the distances of their descendants in the breadth-first search (the
+        # cells reached from them by steps of exactly +1), so those are reset to UNREACHABLE; freed cells can only
+        # shorten distances. Every value is then an upper bound, and relaxing from the changed cells outwards
+        # makes the field exact again
+        bounds = list(self.removed)
+        if self.added:
+            affected = self.descendants(self.added)
+            gx, gy = self.goal
+            affected[gx, gy] = False
+            self.field[1:-1, 1:-1][affected] = self.UNREACHABLE
+            xs = np.flatnonzero(affected.any(axis=1))
+            ys = np.flatnonzero(affected.any(axis=0))
+            if len(xs):
+                bounds.append((xs[0], xs[-1] + 1, ys[0], ys[-1] + 1))
+        self.added = []
+        self.removed = []
+        self.settled = self.UNREACHABLE
+        if bounds:
+            self.relax(min(bound[0] for bound in bounds), max(bound[1] for bound in bounds),
+                       min(bound[2] for bound in bounds), max(bound[3] for bound in bounds))
+
+    def descendants(self, windows: list):
+        # Returns a mask of the cells in windows and every cell reached from them by steps of exactly +1
+        field = self.field[1:-1, 1:-1]
+        affected = np.zeros(field.shape, dtype=bool)
+        for x1, x2, y1, y2 in windows:
+            affected[x1:x2, y1:y2] = True
+        # The frontier is kept as a mask of its bounding box x1:x2, y1:y2
+        x1 = min(window[0] for window in windows)
+        x2 = max(window[1] for window in windows)
+        y1 = min(window[2] for window in windows)
+        y2 = max(window[3] for window in windows)
+        frontier = affected[x1:x2, y1:y2].copy()
+        while True:
+            bx1 = max(x1 - 1, 0)
+            by1 = max(y1 - 1, 0)
+            bx2 = min(x2 + 1, self.cols)
+            by2 = min(y2 + 1, self.rows)
+            box = field[bx1:bx2, by1:by2]
+            step = np.full(box.shape, -1, dtype=np.int64)
+            step[x1 - bx1:x2 - bx1, y1 - by1:y2 - by1] = np.where(frontier, field[x1:x2, y1:y2] + 1, -1)
+            grown = np.zeros(box.shape, dtype=bool)
+            grown[1:, :] |= box[1:, :] == step[:-1, :]
+            grown[:-1, :] |= box[:-1, :] == step[1:, :]
+            grown[:, 1:] |= box[:, 1:] == step[:, :-1]
+            grown[:, :-1] |= box[:, :-1] == step[:, 1:]
+            grown &= ~affected[bx1:bx2, by1:by2]
+            self.updates += box.size
+            if not grown.any():
+                return affected
+            affected[bx1:bx2, by1:by2] |= grown
+            xs = np.flatnonzero(grown.any(axis=1))
+            ys = np.flatnonzero(grown.any(axis=0))
+            frontier = grown[xs[0]:xs[-1] + 1, ys[0]:ys[-1] + 1]
+            x1, x2, y1, y2 = bx1 + xs[0], bx1 + xs[-1] + 1, by1 + ys[0], by1 + ys[-1] + 1
+
+    def relax(self, x1: int, x2: int, y1: int, y2: int):
+        # Repeats field = min(field, smallest neighbour + 1) over free cells until nothing changes, starting with the
+        # cells x1:x2, y1:y2 and then only around the cells the previous pass changed
+        # Blocked cells are UNREACHABLE and the goal's cell stays 0 even when a room covers it
+        field = self.field
+        gx, gy = self.goal
+        while True:
+            x1 = max(x1 - 1, 0)
+            y1 = max(y1 - 1, 0)
+            x2 = min(x2 + 1, self.cols)
+            y2 = min(y2 + 1, self.rows)
+            current = field[x1 + 1:x2 + 1, y1 + 1:y2 + 1]
+            best = np.minimum(np.minimum(field[x1:x2, y1 + 1:y2 + 1], field[x1 + 2:x2 + 2, y1 + 1:y2 + 1]),
+                              np.minimum(field[x1 + 1:x2 + 1, y1:y2], field[x1 + 1:x2 + 1, y1 + 2:y2 + 2])) + 1
+            updated = np.where(self.counts[x1:x2, y1:y2] == 0, np.minimum(current, best), self.UNREACHABLE)
+            if x1 <= gx < x2 and y1 <= gy < y2:
+                updated[gx - x1, gy - y1] = 0
+            changed = updated != current
+            self.updates += current.size
+            if not changed.any():
+                return
+            current[...] = updated
+            xs = np.flatnonzero(changed.any(axis=1))
+            ys = np.flatnonzero(changed.any(axis=0))
+            x1, x2, y1, y2 = x1 + xs[0], x1 + xs[-1] + 1, y1 + ys[0], y1 + ys[-1] + 1
+
+    def exact(self, score: float):
+        # Returns true if score, read without refreshing, is what refresh would leave it at and no other score can
+        # fall below it. Added rooms only lengthen distances, and only of cells further than the smallest step count
+        # they cover (settled), so that holds for scores under settled while no rooms were removed
+        if self.removed:
+            return False
+        return not self.added or score < self.settled
+
+    def score(self, x: float, y: float, goal: tuple, refresh: bool = True):
+        # Returns the heuristic distance of a point: its cell's step count, ties broken by the straight-line distance
+        # to the goal (scaled to stay below one step); inf for points off the grid or walled off from the goal
+        # refresh=False reads the field without applying pending rooms first (see exact)
+        if not (0 <= x <= self.grid_w and 0 <= y <= self.grid_h):
+            return math.inf
+        if refresh and (self.added or self.removed):
+            self.refresh()
+        column, row = self.cell(x, y)
+        steps = self.field[column + 1, row + 1]
+        if steps >= self.UNREACHABLE:
+            return math.inf
+        return steps + math.sqrt((goal[0] - x) ** 2 + (goal[1] - y) ** 2) * 1e-6
+
+    def scores(self, xs, ys, goal: tuple, refresh: bool = True):
+        # Vectorized score for arrays of points
+        if refresh and (self.added or self.removed):
+            self.refresh()
+        inside = (xs >= 0) & (xs <= self.grid_w) & (ys >= 0) & (ys <= self.grid_h)
+        columns = np.clip(xs // self.cell_size, 0, self.cols - 1).astype(np.intp)
+        rows = np.clip(ys // self.cell_size, 0, self.rows - 1).astype(np.intp)
+        steps = self.field[columns + 1, rows + 1]
+        distances = steps + np.sqrt((goal[0] - xs) ** 2 + (goal[1] - ys) ** 2) * 1e-6
+        return np.where(inside & (steps < self.UNREACHABLE), distances, np.inf)
+
+
+class BuildStats:
+    # Counters and timers for one build, collected when DungeonGenerator(collect_stats=True)
+    __slots__ = ('attempts', 'restarts', 'overlap_calls', 'overlap_time', 'comparisons', 'rejected', 'pops',
+                 'random_rooms', 'random_doors', 'scoring_time', 'memo_hits', 'field_updates')
+
+    def __init__(self):
+        self.attempts = 0
+        self.restarts = 0
+        # Calls to overlaps and the total seconds spent in them (collision testing)
+        self.overlap_calls = 0
+        self.overlap_time = 0.0
+        # Rectangle comparisons (SpatialIndex) or bitmap queries (OccupancyGrid) made by those calls
+        self.comparisons = 0
+        # Placements rejected by overlaps, and rooms popped by backtracking or restarts
+        self.rejected = 0
+        self.pops = 0
+        # room_random and door_random overrides that fired
+        self.random_rooms = 0
+        self.random_doors = 0
+        # Seconds spent ranking candidates and picking exits (propose_room)
+        self.scoring_time = 0.0
+        # Placements rejected from the collision memo without calling overlaps
+        self.memo_hits = 0
+        # Cells recomputed by DistanceField updates (heuristic='field')
+        self.field_updates = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        return ', '.join(f'{name}: {getattr(self, name)}' for name in self.__slots__)
+
+
+class BuildEvent:
+    # One step of a streamed build (see DungeonGenerator.iter_build)
+    # kind is 'place' (room appended to the path), 'pop' (room removed by a backtrack) or 'restart' (path dropped
+    # back to where the build began, with a new goal unless the build keeps its goal)
+    __slots__ = ('kind', 'room', 'door', 'length')
+
+    def __init__(self, kind: str, room: Room = None, door: Door = None, length: int = 0):
+        self.kind = kind
+        self.room = room
+        self.door = door
+        # Path length after the step
+        self.length = length
+
+    def __str__(self):
+        name = self.room.name if self.room is not None else None
+        return f'({self.kind}, {name}, {self.door}, {self.length})'
+
+
+@dataclasses.dataclass(frozen=True)
+class GeneratorConfig:
+    # Immutable settings of one DungeonGenerator, defaulting to the module parameters above
+    # finish_thresh: least distance of the goal from the start, as a fraction of the grid on both axes
+    # room_random/door_random: chance (1 - value) of a random room/exit instead of the one closest to the goal
+    # path_length: rooms before the finish is forced, allowed_fails: rejected rooms on a door before backtracking
+    # finish: whether paths end in the finish room; when false a build ends as soon as the path holds path_length
+    # rooms, its last room an ordinary dead end (e.g. side branches)
+    # max_attempts/max_restarts/build_deadline: default build budget (see DungeonGenerator.iter_build)
+    finish_thresh: float = FINISH_THRESH
+    room_random: float = ROOM_RANDOM
+    door_random: float = DOOR_RANDOM
+    path_length: int = PATH_LENGTH
+    allowed_fails: int = ALLOWED_FAILS
+    max_attempts: int = MAX_ATTEMPTS
+    max_restarts: int = MAX_RESTARTS
+    build_deadline: float = BUILD_DEADLINE
+    finish: bool = True
+
+    def __post_init__(self):
+        for name in ['finish_thresh', 'room_random', 'door_random']:
+            if not 0 <= getattr(self, name) <= 1:
+                raise ValueError(name + ' must be between 0 and 1')
+        if self.path_length < 1 or self.allowed_fails < 1 or self.max_attempts < 1 or self.max_restarts < 0:
+            raise ValueError('path_length, allowed_fails and max_attempts must be positive, max_restarts not negative')
+
+    def replace(self, **changes):
+        # Returns a copy of the config with some settings changed
+        return dataclasses.replace(self, **changes)
+
+
+class DungeonBuildError(RuntimeError):
+    # Raised when build_dungeon spends its attempt or time budget, or no goal can be placed in the grid
+    # reason is 'attempts', 'deadline' or 'goal'
+    def __init__(self, message: str, reason: str, attempts: int = 0, restarts: int = 0, elapsed: float = 0.0):
+        super().__init__(message)
+        self.reason = reason
+        self.attempts = attempts
+        self.restarts = restarts
+        self.elapsed = elapsed
 
 
 class DungeonGenerator:
     # Class that contains functions to generate a list of (room, active_door) that represents the dungeon
-    def __init__(self, start: Room, grid_w: int, grid_h: int, prefabs: list[Room]):
+    # collision selects the overlap backend: 'index' (SpatialIndex bucket grid) or 'bitmap' (numpy OccupancyGrid)
+    # config is the generator's GeneratorConfig (the module defaults if None) and never changes during a build
+    # rng is any object with the random module's interface, defaulting to a private random.Random
+    # Generators share no mutable state, so different instances can build concurrently in threads
+    # scoring is 'scalar', 'vector' (numpy, all candidates at once) or 'auto' (vector for large prefab libraries)
+    # collect_stats=True gives every build a fresh BuildStats in self.stats (None otherwise)
+    # before_step(generator) and after_step(generator, outcome) are optional hooks called around every placement
+    # attempt, outcome being 'place', 'reject' or 'dead end'
+    # target, when set to an (x, y), is used as every build's goal instead of a random far point
+    # catalog is an already compiled PrefabCatalog of exactly prefabs (e.g. from prefabLibrary), saving its rebuild
+    # heuristic is 'euclid' (straight-line distance to the goal) or 'field' (numpy DistanceField of field_cell
+    # squares, kept up to date as rooms are placed and popped, which steers around placed rooms and grid edges)
+    def __init__(self, start: Room, grid_w: int, grid_h: int, prefabs: list[Room], bucket_size: int = 64,
+                 collision: str = 'index', rng: random.Random = None, scoring: str = 'auto',
+                 collect_stats: bool = False, catalog: PrefabCatalog = None, config: GeneratorConfig = None,
+                 heuristic: str = 'euclid', field_cell: int = 10):
         self.start: Room = start
         self.goal = None
+        self.target = None
         self.grid_w = grid_w
         self.grid_h = grid_h
-        self.prefabs = prefabs
-        self.path = [(start, start.get_door(0))]
-
-    def generate_goal(self):
+        self.config = config if config is not None else GeneratorConfig()
+        self.prefabs = list(prefabs)
+        self.catalog = catalog if catalog is not None else PrefabCatalog(prefabs)
+        self.bucket_size = bucket_size
+        self.collision = collision
+        self.rng = rng if rng is not None else random.Random()
+        self.build_time = None
+        self.collect_stats = collect_stats
+        self.stats: BuildStats = None
+        self.before_step = None
+        self.after_step = None
+        if scoring not in ('scalar', 'vector', 'auto'):
+            raise ValueError('Unknown scoring mode: ' + str(scoring))
+        if scoring == 'vector':
+            load_numpy()
+        self.scoring = scoring
+        if collision == 'index':
+            self.index = SpatialIndex(bucket_size)
+        elif collision == 'bitmap':
+            self.index = OccupancyGrid(grid_w, grid_h)
+        else:
+            raise ValueError('Unknown collision backend: ' + str(collision))
+        if heuristic == 'euclid':
+            self.field = None
+        elif heuristic == 'field':
+            self.field = DistanceField(grid_w, grid_h, field_cell)
+        else:
+            raise ValueError('Unknown heuristic: ' + str(heuristic))
+        self.heuristic = heuristic
+        self.field_cell = field_cell
+        self.path = []
+        # Rectangles (x, y, w, h) known to collide, mapped to the path length they were tested against, and the
+        # rectangles recorded at each path length, so pop_room can forget the ones a popped room may have caused
+        self.collision_memo = {}
+        self.memo_levels = []
+        self.reset_path(start)
+
+    def reset_path(self, start: Room, door: Door = None):
+        # Empties the path (and the spatial index and collision memo kept in sync with it) down to just the start room
+        # The path continues from door, by default the start room's first door
+        self.path = []
+        self.index.clear()
+        self.collision_memo.clear()
+        self.memo_levels = []
+        if self.field is not None:
+            self.field.clear()
+        self.push_room(start, start.get_door(0) if door is None else door)
+
+    def push_room(self, room: Room, door: Door):
+        # Appends a placed room to the path and registers it in the spatial index (and distance field)
+        self.path.append((room, door))
+        self.index.add(room)
+        if self.field is not None:
+            self.field.add(room)
+
+    def pop_room(self):
+        # Removes the last room from the path and from the spatial index
+        room, door = self.path.pop()
+        self.index.remove(room)
+        if self.field is not None:
+            self.field.remove(room)
+        # Collisions recorded while the room was on the path are no longer known to hold
+        memo_levels = self.memo_levels
+        while len(memo_levels) > len(self.path) + 1:
+            for key in memo_levels.pop():
+                del self.collision_memo[key]
+        return room, door
+
+    def remember_collision(self, room: Room):
+        # Records that room collides with the current path, so the same rectangle isn't tested again until a room
+        # is popped. Rectangles outside the grid never fit, so they're kept until the path is reset
+        key = (room.x, room.y, room.w, room.h)
+        level = len(self.path) if self.in_grid(room) else 0
+        while len(self.memo_levels) <= level:
+            self.memo_levels.append([])
+        self.memo_levels[level].append(key)
+        self.collision_memo[key] = level
+
+    def goal_valid(self, x: int, y: int):
+        # Returns true if (x, y) is far enough from the start (finish_thresh of the grid on both axes) to be the goal
+        finish_thresh = self.config.finish_thresh
+        return abs((self.start.x / self.grid_w) - (x / self.grid_w)) >= finish_thresh \
+            and abs((self.start.y / self.grid_h) - (y / self.grid_h)) >= finish_thresh
+
+    def generate_goal(self, max_tries: int = 1000):
         # Randomly picks a point in the grid to be the goal which the dungeon builds towards
-        # Minimum distance from start determined by FINISH_THRESH global
-        valid = False
-        while not valid:
-            x = random.randint(0, self.grid_w - 10)
-            y = random.randint(0, self.grid_h - 10)
-            log('Possible Finish: ' + str(x) + ', ' + str(y), 'generate finish')
-            if abs((self.start.x / self.grid_w) - (x / self.grid_w)) < FINISH_THRESH \
-                    or abs((self.start.y / self.grid_h) - (y / self.grid_h)) < FINISH_THRESH:
-                valid = False
-                log('Invalid', 'generate finish')
-            else:
-                valid = True
-        self.goal = (x, y)
-        log('Goal: ' + str(self.goal), 'generate finish')
+        # Minimum distance from start determined by the config's finish_thresh
+        # Raises DungeonBuildError if no point qualifies or none is drawn within max_tries
+        if self.target is not None:
+            self.goal = self.target
+            if self.field is not None:
+                self.field.set_goal(self.goal)
+            return
+        far_x = self.grid_w - 10
+        far_y = self.grid_h - 10
+        if not any(self.goal_valid(x, y) for x, y in [(0, 0), (0, far_y), (far_x, 0), (far_x, far_y)]):
+            # The conditions are per axis, so if no corner qualifies no point does
+            raise DungeonBuildError('No point in the grid is far enough from the start for a goal', 'goal')
+        for i in range(max_tries):
+            x = self.rng.randint(0, far_x)
+            y = self.rng.randint(0, far_y)
+            if __debug__ and LOG.generate_finish:
+                log('generate_finish', 'Possible Finish: %s, %s', x, y)
+            if self.goal_valid(x, y):
+                self.goal = (x, y)
+                if self.field is not None:
+                    self.field.set_goal(self.goal)
+                if __debug__ and LOG.generate_finish:
+                    log('generate_finish', 'Goal: %s', self.goal)
+                return
+            if __debug__ and LOG.generate_finish:
+                log('generate_finish', 'Invalid')
+        raise DungeonBuildError('No goal found in ' + str(max_tries) + ' tries', 'goal', max_tries)
 
     def show_prefabs(self, window: PygameDisplay):
         # Draws the generators prefabs on the Pygame window
@@ -385,141 +1217,310 @@ class DungeonGenerator:
 
     def add_rotated_prefabs(self):
         # Adds all rotated versions of the prefabs (no duplicates) to the prefabs
-        full_prefabs = self.prefabs
-
-        for room in self.prefabs:
-            for degree in [90, 180, 270]:
-                rotated_room = room.get_rotated(degree)
-                if rotated_room not in full_prefabs:
-                    full_prefabs.append(rotated_room)
-                    log('Adding rotated room ' + rotated_room.name, 'rotated prefabs')
+        self.prefabs = rotated_prefabs(self.prefabs)
+        self.catalog = PrefabCatalog(self.prefabs)
+
+    def vector_scoring(self):
+        # Returns true if candidates should be ranked with numpy
+        if self.scoring == 'auto' and len(self.catalog.prefabs) >= VECTOR_SCORING_MIN:
+            try:
+                load_numpy()
+            except ImportError:
+                return False
+            return True
+        return self.scoring == 'vector'
 
-        self.prefabs = full_prefabs
+    def in_grid(self, test_room: Room):
+        # Returns true if test_room lies entirely inside the grid
+        return 0 <= test_room.x <= self.grid_w - test_room.w and 0 <= test_room.y <= self.grid_h - test_room.h
 
     def overlaps(self, test_room: Room):
         # Returns true if an unplaced test_room would overlap with any existing room or grid edges
-        if not 0 <= test_room.x <= self.grid_w - test_room.w or not 0 <= test_room.y <= self.grid_h - test_room.h:
+        if not self.in_grid(test_room):
             return True
 
-        test_edges = test_room.get_edges()
-        exist_edges = []
-        for room, door in self.path:
-            new_edges = room.get_edges()
-            for edge in new_edges:
-                exist_edges.append(edge)
-        for test in test_edges:
-            for edge in exist_edges:
-                if test['slope'] != edge['slope']:
-                    if test['slope'] == 'inf':
-                        vert = test
-                        hor = edge
-                    else:
-                        vert = edge
-                        hor = test
-                    intersect = (vert['value'], hor['value'])
-                    if (hor['a'] <= intersect[0] <= hor['b'] and
-                            vert['a'] <= intersect[1] <= vert['b']):
-                        return True
-        return False
-
-    def build_dungeon(self):
-        # Main logic for generating dungeon
-        start_time = time.time()
-        self.generate_goal()
+        # Only nearby rooms (or lattice points) are looked at, whichever backend is in use
+        return self.index.hits(test_room)
+
+    def build_dungeon(self, max_attempts: int = None, deadline: float = None, max_restarts: int = None,
+                      new_goal: bool = True):
+        # Builds the whole dungeon, see iter_build for the arguments
+        # Returns the build time, raises DungeonBuildError when the budget runs out
+        for event in self.iter_build(max_attempts, deadline, max_restarts, new_goal):
+            pass
+        return self.build_time
+
+    def iter_build(self, max_attempts: int = None, deadline: float = None, max_restarts: int = None,
+                   new_goal: bool = True):
+        # Main logic for generating dungeon, as a generator yielding a BuildEvent for every room placed on or
+        # popped off the path as it happens, so consumers can draw, stream or stop early
+        # The search is bounded by max_attempts placement attempts and deadline seconds (defaulting to the
+        # config's max_attempts and build_deadline). The attempts are split evenly between the first try and
+        # max_restarts (config.max_restarts) restarts, each of which drops back to the rooms the path held when
+        # the build began and, with new_goal true, picks a new goal
+        # The build continues from the rooms already on the path; with new_goal false it keeps aiming for the
+        # current goal throughout, restarts included, instead of picking a new one
+        # Returns the build time (also stored as self.build_time, and including time spent by the consumer between
+        # events), raises DungeonBuildError when the budget runs out
+        self.build_time = None
+        stats = self.stats = BuildStats() if self.collect_stats else None
+        before_step = self.before_step
+        after_step = self.after_step
+        start_time = time.perf_counter()
+        config = self.config
+        max_attempts = config.max_attempts if max_attempts is None else max_attempts
+        deadline = config.build_deadline if deadline is None else deadline
+        max_restarts = config.max_restarts if max_restarts is None else max_restarts
+        allowed_fails = config.allowed_fails
+        field = self.field
+        field_start = field.updates if field is not None else 0
+        end_time = None if deadline is None else start_time + deadline
+        restart_every = max(max_attempts // (max_restarts + 1), 1)
+        next_restart = restart_every
+        base_length = len(self.path)
+
+        if new_goal or self.goal is None:
+            self.generate_goal()
+        elif field is not None and field.goal is None:
+            field.set_goal(self.goal)
+        vector = self.vector_scoring()
+        attempts = 0
+        restarts = 0
         failed_rooms = []
-        while self.path[-1][0].name != 'finish':
-            # Loops until the last room in the path is the finish
+        # Backtracks in a row without a room placed in between; each one pops twice as deep
+        backtrack_streak = 0
+        while not self.path_complete():
+            # Loops until the last room in the path is the finish (or the path is long enough without one)
+            if attempts >= max_attempts:
+                raise DungeonBuildError('No dungeon found in ' + str(attempts) + ' placement attempts', 'attempts',
+                                        attempts, restarts, time.perf_counter() - start_time)
+            if end_time is not None and time.perf_counter() > end_time:
+                raise DungeonBuildError('No dungeon found in ' + str(deadline) + ' seconds', 'deadline',
+                                        attempts, restarts, time.perf_counter() - start_time)
+            if attempts >= next_restart and restarts < max_restarts:
+                # Search stalled: drops everything placed by this build and starts over, aiming for a new goal
+                # unless the caller asked to keep the current one
+                restarts += 1
+                next_restart += restart_every
+                while len(self.path) > base_length:
+                    room, door = self.pop_room()
+                    if stats is not None:
+                        stats.pops += 1
+                    yield BuildEvent('pop', room, door, len(self.path))
+                if new_goal:
+                    self.generate_goal()
+                failed_rooms = []
+                backtrack_streak = 0
+                if __debug__ and LOG.build_dungeon:
+                    log('build_dungeon', 'Restart %s with goal %s', restarts, self.goal)
+                yield BuildEvent('restart', length=len(self.path))
+            attempts += 1
+            if before_step is not None:
+                before_step(self)
+
             active_room = self.path[-1][0]
             active_door = self.path[-1][1]
-            log('Active room: ' + active_room.name, 'build dungeon')
-
-            # Creates list of rooms with a door opposite/that could connect to the active_door
-            available_rooms = []
-            if len(self.path) >= PATH_LENGTH:
-                # Forces the only available room to be the finish if the path is at its desired length
-                available_rooms = [Room(0, 0, 20, 20, 'finish',
-                                        [Door(10, 0, 'S'), Door(10, 20, 'N'), Door(0, 10, 'W'), Door(20, 10, 'E')])]
-            else:
-                for room in prefabs:
-                    directions = room.get_directions()
-                    if active_door.opposite() in directions:
-                        if active_room.name != room.name and active_room.name not in failed_rooms:
-                            available_rooms.append(room)
-
-            log('Available Rooms: ' + str(available_rooms), 'False')
-
-            # Gets the room with the door closest to goal (chance to pick a random room based on ROOM_RANDOM)
-            next_room = None
-            best_distance = 10000
-            for room in available_rooms:
-                entrance = room.get_door_by_d(active_door.opposite())
-                dist = room.test_distance(active_door, entrance, self.goal)
-                log(room.name + ': ' + str(dist), 'build dungeon')
-                if dist < best_distance:
-                    best_distance = dist
-                    next_room = room
-            room_chance = random.randint(1, 100) / 100
-            if room_chance > ROOM_RANDOM:
-                log('Best Room: ' + str(next_room.name), 'build dungeon')
-                next_room = random.choice(available_rooms)
-                log('Random Room Triggered', 'build dungeon')
-            log(next_room.name, 'build dungeon')
-
-            # Turns prefab into an actual room
-            copied_next = copy.deepcopy(next_room)
-            copied_next.place_room(active_door, copied_next.get_door_by_d(active_door.opposite()))
-
-            # Gets best door (chance to get random door based on DOOR_RANDOM)
-            next_door = copied_next.get_best_door(self.goal)
-
-            door_chance = random.randint(1, 100) / 100
-            log('door_chance: ' + str(door_chance), 'random door')
-            if door_chance > DOOR_RANDOM and len(copied_next.doors) > 2:
-
-                log('Random Door Triggered', 'random door')
-                log(copied_next.name, 'random door')
-                log('Best Door: ' + str(next_door), 'random door')
-                log('Entrance i: ' + str(copied_next.entrance_i), 'random door')
-                invalid = True
-                while invalid:
-                    random_i = random.randint(0, len(copied_next.doors) - 1)
-                    log('Random i: ' + str(random_i), 'random door')
-                    next_door = copied_next.get_door(random_i)
-                    log('Random door: ' + str(next_door), 'random door')
-                    if random_i != copied_next.entrance_i:
-                        invalid = False
-
-                log('Choosing door instead: ' + str(next_door), 'random door')
-
-            log('Next door: ' + str(next_door), 'build dungeon')
-
-            if not self.overlaps(copied_next):
-                # Adds room to path and resets the failure count/list
-                self.path.append((copied_next, next_door))
-                log('Added ' + str((copied_next.name, next_door)) + ' to path', 'build dungeon')
-                failed_rooms = []
+            if __debug__ and LOG.build_dungeon:
+                log('build_dungeon', 'Active room: %s', active_room.name)
+
+            if stats is None:
+                proposal = self.propose_room(active_room, active_door, failed_rooms, vector)
             else:
+                stats.attempts = attempts
+                stats.restarts = restarts
+                if field is not None:
+                    stats.field_updates = field.updates - field_start
+                step_time = time.perf_counter()
+                proposal = self.propose_room(active_room, active_door, failed_rooms, vector)
+                stats.scoring_time += time.perf_counter() - step_time
+            if proposal is not None:
+                copied_next, next_door = proposal
+                if (copied_next.x, copied_next.y, copied_next.w, copied_next.h) in self.collision_memo:
+                    # Same rectangle already failed against the rooms still on the path
+                    overlapped = True
+                    if stats is not None:
+                        stats.memo_hits += 1
+                else:
+                    if stats is None:
+                        overlapped = self.overlaps(copied_next)
+                    else:
+                        comparisons = self.index.comparisons
+                        step_time = time.perf_counter()
+                        overlapped = self.overlaps(copied_next)
+                        stats.overlap_time += time.perf_counter() - step_time
+                        stats.overlap_calls += 1
+                        stats.comparisons += self.index.comparisons - comparisons
+                    if overlapped:
+                        self.remember_collision(copied_next)
+                if not overlapped:
+                    # Adds room to path and resets the failure count/list
+                    self.push_room(copied_next, next_door)
+                    if __debug__ and LOG.build_dungeon:
+                        log('build_dungeon', 'Added %s to path', (copied_next.name, next_door))
+                    if after_step is not None:
+                        after_step(self, 'place')
+                    yield BuildEvent('place', copied_next, next_door, len(self.path))
+                    failed_rooms = []
+                    backtrack_streak = 0
+                    continue
+
                 # Adds room to the failure list and tries again with a room not in the list
-                log('Room overlapped. Trying again...', 'build dungeon')
+                if __debug__ and LOG.build_dungeon:
+                    log('build_dungeon', 'Room overlapped. Trying again...')
+                if stats is not None:
+                    stats.rejected += 1
+                if after_step is not None:
+                    after_step(self, 'reject')
                 failed_rooms.append(copied_next.name)
-                if len(failed_rooms) < ALLOWED_FAILS:
-                    # Removes the last room added to path and prevents that room from being chosen again if fail count
-                    # exceeds ALLOWED_FAILS to prevent a path where no rooms can be placed
-                    popped, door = self.path.pop(len(self.path) - 1)
-                    log('Too many fails. Popping ' + popped.name, 'build dungeon')
-                    failed_rooms = [popped.name]
-
-            #self.print_path()
+                if len(failed_rooms) < allowed_fails:
+                    continue
+            elif after_step is not None:
+                after_step(self, 'dead end')
+
+            # Too many fails at this level (or nothing fits the active door), so rooms are popped to escape a path
+            # where no rooms can be placed
+            stuck_length = len(self.path)
+            popped = self.backtrack(2 ** backtrack_streak, base_length)
+            backtrack_streak += 1
+            if stats is not None:
+                stats.pops += len(popped)
+            for i, (room, door) in enumerate(popped):
+                yield BuildEvent('pop', room, door, stuck_length - i - 1)
+            if popped:
+                # Keeps the room just popped from being placed straight back on the same door
+                failed_rooms = [popped[-1][0].name]
+            else:
+                # Nothing left to pop, so the next attempt restarts
+                failed_rooms = []
+                next_restart = attempts
 
+        if stats is not None:
+            stats.attempts = attempts
+            stats.restarts = restarts
+            if field is not None:
+                stats.field_updates = field.updates - field_start
         # Calculates the amount of time the generator took
         # Used to verify no excessive looping
-        end_time = time.time()
-        return end_time - start_time
+        self.build_time = time.perf_counter() - start_time
+        return self.build_time
+
+    def path_complete(self):
+        # Returns true once the path is a whole dungeon: ending in the finish room, or path_length rooms long when
+        # the config has finish off
+        if self.config.finish:
+            return self.path[-1][0].name == 'finish'
+        return len(self.path) >= self.config.path_length
+
+    def backtrack(self, levels: int, base_length: int):
+        # Pops up to levels rooms off the path, never leaving fewer than base_length rooms
+        # Returns the popped (room, door) entries in the order they were popped
+        popped = []
+        while len(popped) < levels and len(self.path) > base_length:
+            room, door = self.pop_room()
+            popped.append((room, door))
+            if __debug__ and LOG.build_dungeon:
+                log('build_dungeon', 'Too many fails. Popping %s', room.name)
+        return popped
+
+    def propose_room(self, active_room: Room, active_door: Door, failed_rooms: list, vector: bool):
+        # Picks the next room for active_door and where it leads, without checking for overlaps
+        # Returns (placed room, exit door), or None if no prefab can connect to active_door
+
+        config = self.config
+        # Ranks the rooms with a door opposite/that could connect to the active_door
+        if config.finish and len(self.path) >= config.path_length:
+            # Forces the only available room to be the finish if the path is at its desired length
+            catalog = FINISH_CATALOG
+            available_rooms, best = catalog.rank(active_door, self.goal, field=self.field)
+        else:
+            catalog = self.catalog
+            # Never the active room's own prefab, nor a prefab that already failed on this door
+            exclude = set(failed_rooms)
+            exclude.add(active_room.name)
+            available_rooms, best = catalog.rank(active_door, self.goal, exclude, vector, self.field)
+        if len(available_rooms) == 0:
+            if __debug__ and LOG.build_dungeon:
+                log('build_dungeon', 'No room fits %s', active_door)
+            return None
+        candidates = catalog.candidates(active_door.d)
+
+        # Gets the room with the door closest to goal (chance to pick a random room based on room_random)
+        room_chance = self.rng.randint(1, 100) / 100
+        if room_chance > config.room_random:
+            if __debug__ and LOG.build_dungeon:
+                log('build_dungeon', 'Best Room: %s', candidates[best].room.name)
+            best = self.rng.choice(available_rooms)
+            if self.stats is not None:
+                self.stats.random_rooms += 1
+            if __debug__ and LOG.build_dungeon:
+                log('build_dungeon', 'Random Room Triggered')
+        next_room = candidates[best]
+        if __debug__ and LOG.build_dungeon:
+            log('build_dungeon', '%s', next_room.room.name)
+
+        # Places the prefab next to the active door without copying it
+        copied_next = PlacedRoom(next_room.room, active_door.x + next_room.offset_x,
+                                 active_door.y + next_room.offset_y, next_room.entrance_i)
+        if __debug__ and LOG.place_room:
+            log('place_room', 'Room placed at %s, %s', copied_next.x, copied_next.y)
+
+        # Gets best door (chance to get random door based on door_random)
+        next_door = copied_next.get_door(next_room.best_exit(active_door, self.goal, self.field))
+
+        door_chance = self.rng.randint(1, 100) / 100
+        if __debug__ and LOG.random_door:
+            log('random_door', 'door_chance: %s', door_chance)
+        if door_chance > config.door_random and len(copied_next.doors) > 2:
+            if self.stats is not None:
+                self.stats.random_doors += 1
+            if __debug__ and LOG.random_door:
+                log('random_door', 'Random Door Triggered')
+                log('random_door', '%s', copied_next.name)
+                log('random_door', 'Best Door: %s', next_door)
+                log('random_door', 'Entrance i: %s', copied_next.entrance_i)
+            invalid = True
+            while invalid:
+                random_i = self.rng.randint(0, len(copied_next.doors) - 1)
+                if __debug__ and LOG.random_door:
+                    log('random_door', 'Random i: %s', random_i)
+                next_door = copied_next.get_door(random_i)
+                if __debug__ and LOG.random_door:
+                    log('random_door', 'Random door: %s', next_door)
+                if random_i != copied_next.entrance_i:
+                    invalid = False
+
+            if __debug__ and LOG.random_door:
+                log('random_door', 'Choosing door instead: %s', next_door)
+
+        if __debug__ and LOG.build_dungeon:
+            log('build_dungeon', 'Next door: %s', next_door)
+        return copied_next, next_door
+
+    def truncate(self, keep: int):
+        # Pops rooms off the path until only its first keep rooms are left; the spatial index, collision memo and
+        # distance field only forget what the popped rooms added, so they stay built for the kept ones
+        # Returns the popped (room, door) entries in the order they were popped
+        if not 1 <= keep <= len(self.path):
+            raise ValueError('Can only keep 1 to ' + str(len(self.path)) + ' rooms, not ' + str(keep))
+        popped = []
+        while len(self.path) > keep:
+            popped.append(self.pop_room())
+        return popped
+
+    def reroll(self, keep: int, new_goal: bool = False, max_attempts: int = None, deadline: float = None,
+               max_restarts: int = None):
+        # Keeps the first keep rooms of the path and builds a new rest of the dungeon from the last of them, aiming
+        # for the same goal unless new_goal is true. Only the rebuilt rooms are placed, so a reroll costs about as
+        # much as building that part of the path; see iter_build for the budget arguments
+        # Returns the build time, raises DungeonBuildError when the budget runs out
+        self.truncate(keep)
+        return self.build_dungeon(max_attempts, deadline, max_restarts, new_goal)
 
     def new_dungeon(self):
         # Clears dungeon information and creates a new dungeon with the same generator
-        self.path = [(start, start.get_door(0))]
-        self.build_dungeon()
+        # Returns the build time of the new dungeon
+        self.reset_path(self.start)
+        return self.build_dungeon()
 
     def draw(self, window: PygameDisplay, end_sleep: int = 100000):
         # Turns on Pygame window displaying the full dungeon for end_sleep seconds
@@ -534,20 +1535,37 @@ class DungeonGenerator:
         window.add_room(Room(self.goal[0], self.goal[1], 10, 10, 'goal'), PINK)
         window.on(end_sleep)
 
+    def save_image(self, filename: str, borderThickness: int = 10):
+        # Renders the dungeon offscreen (no window needed) and saves it, e.g. as a PNG thumbnail
+        window = PygameDisplay(self.grid_w, self.grid_h, borderThickness, BLACK, WHITE, offscreen=True)
+        window.draw_path(self.path, self.goal)
+        window.save(filename)
+
     def draw_by_room(self, window: PygameDisplay, room_sleep: float, end_sleep: int = 100000):
         # Turns on Pygame display and draws rooms in dungeon one at a time, with room_sleep seconds between each room
         for room, door in self.path:
-            color = YELLOW
-            if room.name == 'start':
-                color = GREEN
-            elif room.name == 'finish':
-                color = RED
-            window.add_room(room, color)
-            pygame.display.update()
+            window.add_room(room, room_color(room))
+            window.update()
             time.sleep(room_sleep)
         window.on(end_sleep)
         self.print_path()
 
+    def draw_while_building(self, window: PygameDisplay, room_sleep: float, end_sleep: int = 100000):
+        # Builds a new dungeon while drawing it, so rooms appear (and backtracked rooms disappear) as they are placed
+        # Returns the build time
+        self.reset_path(self.start)
+        window.add_room(self.start, GREEN)
+        for event in self.iter_build():
+            if event.kind == 'place':
+                window.add_room(event.room, room_color(event.room))
+                window.update()
+                time.sleep(room_sleep)
+            elif event.kind == 'pop':
+                window.remove_room(event.room)
+                window.update()
+        window.on(end_sleep)
+        return self.build_time
+
     def print_path(self):
         # Prints the list of (room, door)
         print('Path:')
@@ -568,19 +1586,25 @@ prefabs = [
 ]
 
 # Main
-window = PygameDisplay(500, 500, 10, BLACK, WHITE)
-start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
-g = DungeonGenerator(start, 500, 500, prefabs)
-g.add_rotated_prefabs()
-# g.show_prefabs(window)
-build_dungeon_time = g.build_dungeon()
-# g.print_path()
-# g.draw(window)
-g.draw_by_room(window, .25, 2)
-print('Dungeon Build Time: ' + str(build_dungeon_time))
-while True:
-    window.reset()
-    g.new_dungeon()
+def main():
+    # Demo: builds a dungeon, draws it room by room, then keeps regenerating
+    window = PygameDisplay(500, 500, 10, BLACK, WHITE)
+    start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, prefabs)
+    g.add_rotated_prefabs()
+    # g.show_prefabs(window)
+    build_dungeon_time = g.build_dungeon()
+    # g.print_path()
+    # g.draw(window)
     g.draw_by_room(window, .25, 2)
-    g.print_path()
     print('Dungeon Build Time: ' + str(build_dungeon_time))
+    while True:
+        window.reset()
+        build_dungeon_time = g.new_dungeon()
+        g.draw_by_room(window, .25, 2)
+        g.print_path()
+        print('Dungeon Build Time: ' + str(build_dungeon_time))
+
+
+if __name__ == '__main__':
+    main()
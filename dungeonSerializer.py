@@ -0,0 +1,280 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import random
+import struct
+from dungeonGeneratorClass import DungeonGenerator, PlacedRoom, FINISH_PREFAB, load_numpy
+
+
+# A dungeon is encoded as a header (room count, goal x, goal y) followed by one fixed-width record per room:
+# prefab id, x, y, entrance door index and exit door index (-1 when there is none)
+HEADER = struct.Struct('<Hii')
+ROOM = struct.Struct('<Hiibb')
+# numpy layout of a room record, identical to ROOM
+ROOM_DTYPE: list = [('prefab', '<u2'), ('x', '<i4'), ('y', '<i4'), ('entrance', 'i1'), ('exit', 'i1')]
+# Limits of those fields: prefab ids are uint16, door indices int8 (so -1 fits) and the room count uint16
+MAX_PREFABS: int = 2 ** 16
+MAX_DOORS: int = 2 ** 7
+MAX_ROOMS: int = 2 ** 16 - 1
+
+# Store files: magic, version, catalog hash, dungeon count, room count, then the room records, the goals
+# (int32 pairs) and the room offsets of every dungeon (uint64, count + 1 entries)
+STORE_MAGIC = b'DGNS'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sI32sQQ8x')
+
+
+def prefab_table(generator: DungeonGenerator):
+    # Returns the rooms prefab ids refer to: the start room, the finish room, then the generator's prefabs
+    return (generator.start, FINISH_PREFAB) + generator.catalog.prefabs
+
+
+def catalog_hash(generator: DungeonGenerator):
+    # Returns a sha256 digest of the prefab table, so encoded dungeons are only decoded with the same prefabs
+    digest = hashlib.sha256()
+    for room in prefab_table(generator):
+        doors = ';'.join(f'{door.x},{door.y},{door.d}' for door in room.doors)
+        digest.update(f'{room.name}|{room.w}|{room.h}|{doors}\n'.encode())
+    return digest.digest()
+
+
+def generator_params(generator: DungeonGenerator):
+    # Returns the settings a seeded build depends on, as a JSON-serializable dict
+    config = generator.config
+    return {
+        'grid': [generator.grid_w, generator.grid_h],
+        'start': [generator.start.x, generator.start.y],
+        'finish_thresh': config.finish_thresh,
+        'room_random': config.room_random,
+        'door_random': config.door_random,
+        'path_length': config.path_length,
+        'allowed_fails': config.allowed_fails,
+        'max_attempts': config.max_attempts,
+        'max_restarts': config.max_restarts,
+        'finish': config.finish,
+        'heuristic': generator.heuristic,
+        'field_cell': generator.field_cell if generator.heuristic == 'field' else None,
+    }
+
+
+def check_table(table: tuple):
+    # Raises ValueError if some room of a prefab table couldn't be written as a ROOM record, rather than letting
+    # struct.pack fail on it or numpy silently wrap its id
+    if len(table) > MAX_PREFABS:
+        raise ValueError('Can only encode ' + str(MAX_PREFABS) + ' prefabs (rotations, start and finish included), '
+                         'not ' + str(len(table)))
+    for room in table:
+        if len(room.doors) > MAX_DOORS:
+            raise ValueError('Can only encode prefabs of up to ' + str(MAX_DOORS) + ' doors, not ' + room.name
+                             + ' with ' + str(len(room.doors)))
+
+
+def prefab_ids(generator: DungeonGenerator):
+    # Returns a dict from id() of each table room to its prefab id, raising ValueError if the table can't be encoded
+    table = prefab_table(generator)
+    check_table(table)
+    return {id(room): i for i, room in enumerate(table)}
+
+
+def room_records(path: list, ids: dict):
+    # Returns the (prefab id, x, y, entrance, exit) records of a path
+    records = []
+    for room, door in path:
+        prefab = room.prefab if isinstance(room, PlacedRoom) else room
+        exit_i = -1
+        for i in range(len(room.doors)):
+            if room.get_door(i) == door:
+                exit_i = i
+                break
+        records.append((ids[id(prefab)], room.x, room.y, room.entrance_i, exit_i))
+    return records
+
+
+def encode(generator: DungeonGenerator, path: list = None, goal: tuple = None):
+    # Returns the binary encoding of a path (by default the generator's current path and goal)
+    # Raises ValueError if the prefab table or the path is too large for the record format
+    path = generator.path if path is None else path
+    goal = generator.goal if goal is None else goal
+    records = room_records(path, prefab_ids(generator))
+    if len(records) > MAX_ROOMS:
+        raise ValueError('Can only encode dungeons of up to ' + str(MAX_ROOMS) + ' rooms, not ' + str(len(records)))
+    output = bytearray(HEADER.pack(len(records), goal[0], goal[1]))
+    for record in records:
+        output += ROOM.pack(*record)
+    return bytes(output)
+
+
+def path_from_records(generator: DungeonGenerator, records):
+    # Rebuilds a path of (room, exit door) from room records, using the generator's own start room
+    table = prefab_table(generator)
+    path = []
+    for prefab_id, x, y, entrance_i, exit_i in records:
+        prefab_id = int(prefab_id)
+        if prefab_id == 0:
+            room = generator.start
+        else:
+            room = PlacedRoom(table[prefab_id], int(x), int(y), int(entrance_i))
+        path.append((room, room.get_door(int(exit_i)) if exit_i >= 0 else None))
+    return path
+
+
+def decode(generator: DungeonGenerator, data: bytes):
+    # Returns (path, goal) from encode's output
+    count, goal_x, goal_y = HEADER.unpack_from(data)
+    records = [ROOM.unpack_from(data, HEADER.size + i * ROOM.size) for i in range(count)]
+    return path_from_records(generator, records), (goal_x, goal_y)
+
+
+def restore(generator: DungeonGenerator, path: list, goal: tuple):
+    # Makes a decoded path the generator's current dungeon, collision state included
+    generator.reset_path(generator.start)
+    for room, door in path[1:]:
+        generator.push_room(room, door)
+    generator.goal = goal
+
+
+def to_json(generator: DungeonGenerator, path: list = None, goal: tuple = None):
+    # Returns the JSON form of a path (by default the generator's current path and goal)
+    path = generator.path if path is None else path
+    goal = generator.goal if goal is None else goal
+    records = room_records(path, prefab_ids(generator))
+    return json.dumps({
+        'catalog': catalog_hash(generator).hex(),
+        'goal': list(goal),
+        'rooms': [{'prefab': prefab_id, 'name': room.name, 'x': x, 'y': y, 'entrance': entrance_i, 'exit': exit_i}
+                  for (prefab_id, x, y, entrance_i, exit_i), (room, door) in zip(records, path)],
+    })
+
+
+def from_json(generator: DungeonGenerator, text: str):
+    # Returns (path, goal) from to_json's output, raising ValueError if it was made with other prefabs
+    data = json.loads(text)
+    if data['catalog'] != catalog_hash(generator).hex():
+        raise ValueError('Dungeon was encoded with a different prefab catalog')
+    records = [(room['prefab'], room['x'], room['y'], room['entrance'], room['exit']) for room in data['rooms']]
+    return path_from_records(generator, records), tuple(data['goal'])
+
+
+def encode_many(generator: DungeonGenerator, dungeons: list):
+    # Bulk encodes a list of (path, goal) into numpy arrays (room offsets, goals, room records)
+    # Dungeon i's records are rooms[offsets[i]:offsets[i + 1]]
+    np = load_numpy()
+    ids = prefab_ids(generator)
+    offsets = np.zeros(len(dungeons) + 1, dtype='<u8')
+    goals = np.zeros((len(dungeons), 2), dtype='<i4')
+    records = []
+    for i, (path, goal) in enumerate(dungeons):
+        records.extend(room_records(path, ids))
+        offsets[i + 1] = len(records)
+        goals[i] = goal
+    return offsets, goals, np.array(records, dtype=ROOM_DTYPE)
+
+
+def decode_many(generator: DungeonGenerator, offsets, goals, rooms):
+    # Inverse of encode_many, returns a list of (path, goal)
+    output = []
+    for i in range(len(goals)):
+        records = rooms[int(offsets[i]):int(offsets[i + 1])].tolist()
+        output.append((path_from_records(generator, records), (int(goals[i][0]), int(goals[i][1]))))
+    return output
+
+
+def write_store(filename: str, generator: DungeonGenerator, dungeons):
+    # Writes an iterable of (path, goal) to a store file, streaming the room records so the input can be huge
+    # Returns the number of dungeons written
+    np = load_numpy()
+    ids = prefab_ids(generator)
+    offsets = [0]
+    goals = []
+    with open(filename, 'wb') as file:
+        file.write(bytes(STORE_HEADER.size))
+        for path, goal in dungeons:
+            records = room_records(path, ids)
+            file.write(np.array(records, dtype=ROOM_DTYPE).tobytes())
+            offsets.append(offsets[-1] + len(records))
+            goals.append(goal)
+        file.write(np.array(goals, dtype='<i4').reshape(-1, 2).tobytes())
+        file.write(np.array(offsets, dtype='<u8').tobytes())
+        file.seek(0)
+        file.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, catalog_hash(generator), len(goals), offsets[-1]))
+    return len(goals)
+
+
+class DungeonStore:
+    # Read-only, memory-mapped view of a store file written by write_store
+    # Only the pages of the dungeons actually read are loaded, so files can hold millions of dungeons
+    def __init__(self, filename: str):
+        np = load_numpy()
+        with open(filename, 'rb') as file:
+            magic, version, digest, count, room_count = STORE_HEADER.unpack(file.read(STORE_HEADER.size))
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(filename + ' is not a dungeon store')
+        self.catalog = digest
+        self.count = count
+        position = STORE_HEADER.size
+        self.rooms = np.memmap(filename, dtype=ROOM_DTYPE, mode='r', offset=position, shape=(room_count,))
+        position += room_count * self.rooms.dtype.itemsize
+        self.goals = np.memmap(filename, dtype='<i4', mode='r', offset=position, shape=(count, 2))
+        position += count * 8
+        self.offsets = np.memmap(filename, dtype='<u8', mode='r', offset=position, shape=(count + 1,))
+
+    def __len__(self):
+        return self.count
+
+    def records(self, index: int):
+        # Returns the room records of a dungeon as a numpy structured array (a view into the file)
+        return self.rooms[int(self.offsets[index]):int(self.offsets[index + 1])]
+
+    def dungeon(self, generator: DungeonGenerator, index: int):
+        # Returns (path, goal) of a dungeon, raising ValueError if the generator's prefabs don't match the store
+        if catalog_hash(generator) != self.catalog:
+            raise ValueError('Store was written with a different prefab catalog')
+        goal = self.goals[index]
+        return path_from_records(generator, self.records(index).tolist()), (int(goal[0]), int(goal[1]))
+
+
+class DungeonCache:
+    # On-disk cache of encoded dungeons keyed by (seed, generator parameters, prefab catalog hash)
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, generator: DungeonGenerator, seed):
+        description = json.dumps({'seed': seed, 'params': generator_params(generator),
+                                  'catalog': catalog_hash(generator).hex()}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def filename(self, generator: DungeonGenerator, seed):
+        return os.path.join(self.directory, self.key(generator, seed) + '.dgn')
+
+    def get(self, generator: DungeonGenerator, seed):
+        # Returns (path, goal) for the seed if it is cached, else None
+        try:
+            with open(self.filename(generator, seed), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        return decode(generator, data)
+
+    def build(self, generator: DungeonGenerator, seed):
+        # Makes the seed's dungeon the generator's current one, building and caching it only on a cache miss
+        # The build uses random.Random(seed) in place of the generator's rng
+        # Returns true on a cache hit
+        cached = self.get(generator, seed)
+        if cached is not None:
+            restore(generator, *cached)
+            return True
+        rng = generator.rng
+        generator.rng = random.Random(seed)
+        try:
+            generator.reset_path(generator.start)
+            generator.build_dungeon()
+        finally:
+            generator.rng = rng
+        filename = self.filename(generator, seed)
+        temporary = filename + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(encode(generator))
+        os.replace(temporary, filename)
+        return False
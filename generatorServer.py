@@ -0,0 +1,352 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import dungeonGeneratorClass as dg
+from dungeonGeneratorClass import DungeonGenerator, DungeonBuildError, Door, Room, GeneratorConfig
+from dungeonSerializer import to_json
+from percentiles import percentile
+
+
+# Limits on what a generation request may ask for
+MAX_GRID: int = 10000
+MAX_PATH_LENGTH: int = 500
+MAX_BODY: int = 65536
+# Per-build time limit in seconds, so one bad request can't hold a worker
+SERVER_DEADLINE: float = 2.0
+# Generators kept per worker, one per (prefab set, grid size)
+WORKER_GENERATORS: int = 32
+# Latencies kept for the metrics percentiles
+LATENCY_WINDOW: int = 1000
+
+HTTP_REASONS: dict = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                      413: 'Payload Too Large', 422: 'Unprocessable Entity', 503: 'Service Unavailable'}
+
+# Per-process generators (one per prefab set, holding its rotated prefabs and compiled catalog) and generators per
+# grid size, set up by init_worker
+worker_prefabs: dict = None
+worker_generators: collections.OrderedDict = None
+
+
+class RequestError(ValueError):
+    # Raised for a generation request the server won't build, status being the HTTP status to answer with
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def init_worker(prefab_sets: dict):
+    # ProcessPoolExecutor initializer: receives the prefab sets once, adds their rotations and compiles their
+    # catalogs, so requests only carry the set's name
+    global worker_prefabs, worker_generators
+    worker_prefabs = {}
+    worker_generators = collections.OrderedDict()
+    for name, prefabs in prefab_sets.items():
+        g = DungeonGenerator(default_start(500), 500, 500, prefabs)
+        g.add_rotated_prefabs()
+        worker_prefabs[name] = g
+
+
+def warm_worker():
+    # Submitted once per worker by GeneratorServer.start so every process is running before the first request
+    return os.getpid()
+
+
+def default_start(grid_w: int):
+    # Start room of every served dungeon: top middle of the grid, like the demo's
+    return Room(grid_w // 2 - 20, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+
+
+def worker_generator(prefab_set: str, grid_w: int, grid_h: int):
+    # Returns this worker's generator for a prefab set and grid size, keeping the WORKER_GENERATORS most recent
+    key = (prefab_set, grid_w, grid_h)
+    g = worker_generators.get(key)
+    if g is None:
+        compiled = worker_prefabs[prefab_set]
+        g = DungeonGenerator(default_start(grid_w), grid_w, grid_h, compiled.prefabs, catalog=compiled.catalog)
+        worker_generators[key] = g
+        while len(worker_generators) > WORKER_GENERATORS:
+            worker_generators.popitem(last=False)
+    else:
+        worker_generators.move_to_end(key)
+    return g
+
+
+def build_requests(requests: list):
+    # Builds a batch of validated requests on this worker
+    # Returns a list of (True, dungeon JSON, build time) or (False, error message, elapsed seconds)
+    results = []
+    for request in requests:
+        g = worker_generator(request['prefabs'], request['grid'][0], request['grid'][1])
+        g.config = g.config.replace(path_length=request['path_length'])
+        g.rng = random.Random(request['seed'])
+        g.reset_path(g.start)
+        try:
+            build_time = g.build_dungeon(deadline=SERVER_DEADLINE)
+        except DungeonBuildError as error:
+            results.append((False, str(error), error.elapsed))
+            continue
+        results.append((True, to_json(g), build_time))
+    return results
+
+
+def is_integer(value):
+    # Returns true for JSON integers, which excludes true/false even though bool subclasses int
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_request(body: dict, prefab_sets: dict):
+    # Validates a generation request, returning it with defaults filled in
+    # Raises RequestError for anything the server won't build
+    if not isinstance(body, dict):
+        raise RequestError('Request body must be a JSON object')
+    grid = body.get('grid', 500)
+    if is_integer(grid):
+        grid = [grid, grid]
+    if not (isinstance(grid, list) and len(grid) == 2 and all(is_integer(size) for size in grid)):
+        raise RequestError('grid must be an integer or a [width, height] pair')
+    if not all(50 <= size <= MAX_GRID for size in grid):
+        raise RequestError('grid sizes must be between 50 and ' + str(MAX_GRID))
+    path_length = body.get('path_length', GeneratorConfig.path_length)
+    if not is_integer(path_length) or not 1 <= path_length <= MAX_PATH_LENGTH:
+        raise RequestError('path_length must be an integer between 1 and ' + str(MAX_PATH_LENGTH))
+    prefabs = body.get('prefabs', 'default')
+    if prefabs not in prefab_sets:
+        raise RequestError('Unknown prefab set: ' + str(prefabs))
+    seed = body.get('seed')
+    if seed is None:
+        seed = random.getrandbits(64)
+    elif not (is_integer(seed) or isinstance(seed, str)):
+        raise RequestError('seed must be an integer or a string')
+    return {'grid': grid, 'path_length': path_length, 'prefabs': prefabs, 'seed': seed}
+
+
+class GeneratorServer:
+    # asyncio HTTP server answering POST /generate with a JSON dungeon and GET /metrics with its counters
+    # Requests wait in a queue of queue_size entries (fuller than that, they are answered 503 straight away) and are
+    # handed to a pool of worker processes in batches of up to batch_size, a batch waiting at most batch_wait
+    # seconds to fill up. The pool holds the rotated prefab_sets ({name: prefab list}, by default the bundled
+    # prefabs as 'default') and is started and warmed up before the server accepts connections
+    def __init__(self, prefab_sets: dict = None, workers: int = None, queue_size: int = 256, batch_size: int = 16,
+                 batch_wait: float = .005):
+        self.prefab_sets = prefab_sets if prefab_sets is not None else {'default': dg.prefabs}
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pool = None
+        self.queue = None
+        self.server = None
+        self.dispatcher = None
+        self.batches = set()
+        # Counters for /metrics
+        self.received = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.batch_count = 0
+        self.batched_requests = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.started = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765):
+        # Starts the worker pool, waits for every worker to be up, then starts listening
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                        initargs=(self.prefab_sets,))
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warm_worker) for i in range(self.workers)])
+        self.queue = asyncio.Queue(self.queue_size)
+        self.dispatcher = asyncio.create_task(self.dispatch())
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.started = time.perf_counter()
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        for batch in list(self.batches):
+            await batch
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    async def generate(self, body: dict):
+        # Queues one generation request and waits for its result
+        # Returns (True, dungeon JSON, build time) or (False, error message, elapsed seconds)
+        # Raises RequestError for an invalid request, or with status 503 when the queue is full
+        self.received += 1
+        request = parse_request(body, self.prefab_sets)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((request, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise RequestError('Generation queue is full', 503)
+        return await future
+
+    async def dispatch(self):
+        # Takes requests off the queue in batches and sends each batch to the pool, with at most one batch per
+        # worker in flight so the queue (not the pool) is where requests wait
+        slots = asyncio.Semaphore(self.workers)
+        while True:
+            batch = [await self.queue.get()]
+            batch_end = time.perf_counter() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = batch_end - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await slots.acquire()
+            task = asyncio.create_task(self.run_batch(batch, slots))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def run_batch(self, batch: list, slots: asyncio.Semaphore):
+        # Builds a batch on the pool and resolves each request's future
+        self.batch_count += 1
+        self.batched_requests += len(batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.pool, build_requests, [request for request, future, queued in batch])
+        except Exception as error:
+            results = [(False, 'Worker failed: ' + str(error), 0.0)] * len(batch)
+        finally:
+            slots.release()
+        now = time.perf_counter()
+        for (request, future, queued), result in zip(batch, results):
+            self.latencies.append(now - queued)
+            if result[0]:
+                self.completed += 1
+            else:
+                self.failed += 1
+            if not future.done():
+                future.set_result(result)
+
+    def metrics(self):
+        # Returns the server's counters, queue depth and request latency percentiles (seconds, queueing included)
+        latencies = list(self.latencies)
+        return {
+            'uptime': time.perf_counter() - self.started if self.started is not None else 0.0,
+            'workers': self.workers,
+            'received': self.received,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'failed': self.failed,
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'queue_size': self.queue_size,
+            'batches_in_flight': len(self.batches),
+            'batches': self.batch_count,
+            'mean_batch_size': self.batched_requests / self.batch_count if self.batch_count else None,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'latency_p99': percentile(latencies, 99),
+        }
+
+    async def respond(self, request_line: str, body: bytes):
+        # Returns (status, JSON text) for one HTTP request
+        parts = request_line.split()
+        if len(parts) < 2:
+            return 400, json.dumps({'error': 'Malformed request line'})
+        method, target = parts[0], parts[1]
+        if target == '/metrics':
+            if method != 'GET':
+                return 405, json.dumps({'error': 'Use GET'})
+            return 200, json.dumps(self.metrics())
+        if target != '/generate':
+            return 404, json.dumps({'error': 'Unknown path ' + target})
+        if method != 'POST':
+            return 405, json.dumps({'error': 'Use POST'})
+        try:
+            # Bodies that aren't UTF-8 raise UnicodeDecodeError, which like JSONDecodeError is a ValueError
+            request = json.loads(body or b'{}')
+        except ValueError as error:
+            return 400, json.dumps({'error': 'Invalid JSON: ' + str(error)})
+        try:
+            ok, output, build_time = await self.generate(request)
+        except RequestError as error:
+            return error.status, json.dumps({'error': str(error)})
+        if not ok:
+            return 422, json.dumps({'error': output, 'elapsed': build_time})
+        # output is already JSON, so it is spliced in rather than parsed and dumped again
+        return 200, '{"build_time": ' + json.dumps(build_time) + ', "dungeon": ' + output + '}'
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Serves HTTP/1.1 requests on one connection until the client closes it or asks to
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # Without a usable length the body can't be skipped, so the connection is closed after answering
+                    status, text = 400, json.dumps({'error': 'Invalid Content-Length'})
+                    keep_alive = False
+                elif length > MAX_BODY:
+                    status, text = 413, json.dumps({'error': 'Request body too large'})
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, text = await self.respond(request_line.decode('latin-1'), body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                payload = text.encode()
+                writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(payload)}\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, workers: int, queue_size: int, batch_size: int, batch_wait: float):
+    server = GeneratorServer(workers=workers, queue_size=queue_size, batch_size=batch_size, batch_wait=batch_wait)
+    listener = await server.start(host, port)
+    print(f'Serving on http://{host}:{port} with {server.workers} workers')
+    try:
+        await listener.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Localhost dungeon generation server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--queue-size', type=int, default=256, help='queued requests before answering 503')
+    parser.add_argument('--batch-size', type=int, default=16, help='most requests sent to a worker at once')
+    parser.add_argument('--batch-wait', type=float, default=.005, help='seconds a batch waits to fill up')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue_size, args.batch_size, args.batch_wait))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,12 @@
+from __future__ import annotations
+
+
+def percentile(values: list, p: float):
+    # Returns the p-th percentile (0-100) of values by linear interpolation, None for no values
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import pickle
+from dungeonGeneratorClass import DungeonGenerator, Door, Room, PrefabCatalog, OPPOSITE, load_numpy, rotated_prefabs
+
+
+# Bumped whenever the cached catalog layout changes, so stale cache files are rebuilt instead of loaded
+LIBRARY_CACHE_VERSION: int = 1
+
+
+def room_from_dict(data: dict):
+    # Returns the prefab described by {'name', 'w', 'h', 'doors': [[x, y, direction], ...]}
+    return Room(0, 0, data['w'], data['h'], data['name'], [Door(x, y, d) for x, y, d in data['doors']])
+
+
+def room_to_dict(room: Room):
+    return {'name': room.name, 'w': room.w, 'h': room.h, 'doors': [[door.x, door.y, door.d] for door in room.doors]}
+
+
+def read_prefabs(filename: str):
+    # Returns the prefabs of a library file, a JSON list of room dicts (see room_from_dict)
+    with open(filename) as file:
+        return [room_from_dict(data) for data in json.load(file)]
+
+
+def write_prefabs(filename: str, prefabs: list[Room]):
+    with open(filename, 'w') as file:
+        json.dump([room_to_dict(room) for room in prefabs], file)
+
+
+class PrefabLibrary:
+    # Rotation-expanded prefabs and their compiled PrefabCatalog, ready to hand to any number of generators
+    def __init__(self, prefabs: list[Room], catalog: PrefabCatalog):
+        self.prefabs = prefabs
+        self.catalog = catalog
+
+    def generator(self, start: Room, grid_w: int, grid_h: int, **kwargs):
+        # Returns a DungeonGenerator using the library's prefabs and catalog (no rotation or compile step)
+        return DungeonGenerator(start, grid_w, grid_h, self.prefabs, catalog=self.catalog, **kwargs)
+
+
+def compile_library(prefabs: list[Room], rotate: bool = True):
+    # Expands the prefabs' rotations and compiles their catalog, including the numpy scoring arrays when numpy is
+    # available
+    if rotate:
+        prefabs = rotated_prefabs(prefabs)
+    catalog = PrefabCatalog(prefabs)
+    try:
+        load_numpy()
+    except ImportError:
+        pass
+    else:
+        for active_d in OPPOSITE:
+            if catalog.candidates(active_d):
+                catalog.vector_data(active_d)
+    return PrefabLibrary(prefabs, catalog)
+
+
+def load_library(filename: str, cache_directory: str = None, rotate: bool = True):
+    # Reads a library file and returns its compiled PrefabLibrary
+    # With a cache_directory, the compiled library is pickled there under the hash of the file's contents and
+    # loaded from that on later calls, so large libraries are only expanded and compiled once
+    # Cache files are trusted, so the directory must only be writable by the user running the generator
+    if cache_directory is None:
+        return compile_library(read_prefabs(filename), rotate)
+
+    with open(filename, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data)
+    digest.update(f'|{rotate}|{LIBRARY_CACHE_VERSION}'.encode())
+    cached = os.path.join(cache_directory, digest.hexdigest() + '.catalog')
+    try:
+        with open(cached, 'rb') as file:
+            prefabs, catalog = pickle.load(file)
+        return PrefabLibrary(prefabs, catalog)
+    except FileNotFoundError:
+        pass
+    except (pickle.UnpicklingError, AttributeError, EOFError, ImportError, ValueError, TypeError):
+        # Written by an incompatible version of the generator, so it is rebuilt below
+        pass
+
+    library = compile_library([room_from_dict(room) for room in json.loads(data)], rotate)
+    os.makedirs(cache_directory, exist_ok=True)
+    temporary = cached + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary, 'wb') as file:
+        pickle.dump((library.prefabs, library.catalog), file, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, cached)
+    return library
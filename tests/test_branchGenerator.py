@@ -0,0 +1,16 @@
+import random
+from dungeonGeneratorClass import DungeonGenerator, Room, Door, prefabs
+from branchGenerator import BranchBuilder
+
+
+def test_branches_never_end_in_finish():
+    start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, prefabs, rng=random.Random(3))
+    g.add_rotated_prefabs()
+    g.build_dungeon()
+    with BranchBuilder(g, workers=1) as builder:
+        branches = builder.grow(0)
+    assert branches
+    for branch in branches:
+        assert all(room.name != 'finish' for room, door in branch.path)
+    assert [room.name for room, door in g.path].count('finish') == 1
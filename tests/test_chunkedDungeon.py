@@ -0,0 +1,74 @@
+import tempfile
+from dungeonGeneratorClass import DOOR_GAP, OPPOSITE, Room, prefabs
+from chunkedDungeon import ChunkedDungeon
+
+
+def overlap(a, b):
+    return a.x <= b.x + b.w and b.x <= a.x + a.w and a.y <= b.y + b.h and b.y <= a.y + a.h
+
+
+def reachable(rooms: list, first: int):
+    # Returns the indices of the rooms reachable from rooms[first] through pairs of facing doors
+    doors = {}
+    for i, room in enumerate(rooms):
+        for j in range(len(room.doors)):
+            door = room.get_door(j)
+            doors.setdefault((door.x, door.y, door.d), []).append(i)
+    seen = {first}
+    stack = [first]
+    while stack:
+        room = rooms[stack.pop()]
+        for j in range(len(room.doors)):
+            door = room.get_door(j)
+            gap_x, gap_y = DOOR_GAP[door.d]
+            for i in doors.get((door.x + gap_x, door.y + gap_y, OPPOSITE[door.d]), []):
+                if i not in seen:
+                    seen.add(i)
+                    stack.append(i)
+    return seen
+
+
+def signature(chunk):
+    return [[(room.name, room.x, room.y, room.w, room.h, str(door)) for room, door in leg] for leg in chunk.legs]
+
+
+def test_chunk_portals_connect():
+    world = ChunkedDungeon(11, prefabs)
+    for cx in range(3):
+        for cy in range(3):
+            chunk = world.chunk(cx, cy)
+            rooms = list(chunk.rooms())
+            portals = [rooms.index(leg[0][0]) for leg in chunk.legs]
+            assert len(portals) == 4
+            assert set(portals) <= reachable(rooms, portals[0])
+            assert not any(room.name == 'finish' for room in rooms)
+            for i in range(len(rooms)):
+                assert 0 <= rooms[i].x and rooms[i].x + rooms[i].w < world.chunk_size
+                assert 0 <= rooms[i].y and rooms[i].y + rooms[i].h < world.chunk_size
+                for j in range(i + 1, len(rooms)):
+                    assert not overlap(rooms[i], rooms[j])
+
+
+def test_neighbouring_chunks_connect_without_touching():
+    world = ChunkedDungeon(11, prefabs)
+    for neighbour in [(1, 0), (0, 1)]:
+        chunks = [world.chunk(0, 0), world.chunk(*neighbour)]
+        rooms = [[Room(x, y, room.w, room.h, room.name, room.doors) for room, x, y in chunk.world_rooms()]
+                 for chunk in chunks]
+        for a in rooms[0]:
+            for b in rooms[1]:
+                assert not overlap(a, b)
+        # Everything in the neighbour is reachable from the W portal of chunk (0, 0) through the shared portals
+        joined = rooms[0] + rooms[1]
+        assert reachable(joined, 0) == set(range(len(joined)))
+
+
+def test_chunks_are_deterministic_and_spill():
+    world = ChunkedDungeon(5, prefabs)
+    expected = {(cx, cy): signature(world.chunk(cx, cy)) for cx in range(3) for cy in range(2)}
+    spilling = ChunkedDungeon(5, prefabs, cache_size=1, spill_directory=tempfile.mkdtemp())
+    for key in reversed(list(expected)):
+        assert signature(spilling.chunk(*key)) == expected[key]
+    for key in expected:
+        assert signature(spilling.chunk(*key)) == expected[key]
+    assert spilling.loaded > 0
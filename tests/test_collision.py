@@ -0,0 +1,88 @@
+import random
+import pytest
+from dungeonGeneratorClass import DungeonGenerator, Room, Door, SpatialIndex, OccupancyGrid, prefabs
+
+# A room spanning several 64 unit buckets, and test rooms against it: (x, y, w, h, whether they collide)
+BIG_ROOM = (100, 100, 200, 200)
+CASES = [
+    ((150, 150, 20, 20), True),    # entirely inside
+    ((50, 50, 300, 300), True),    # entirely around it
+    ((80, 150, 40, 20), True),     # crossing its W edge
+    ((290, 290, 30, 30), True),    # crossing its NE corner
+    ((150, 40, 20, 300), True),    # crossing it from S to N without a corner inside
+    ((300, 150, 20, 20), True),    # touching its E edge, which closed rectangles count
+    ((300, 300, 10, 10), True),    # touching its NE corner
+    ((301, 150, 20, 20), False),   # one unit off its E edge
+    ((150, 79, 20, 20), False),    # one unit off its S edge
+    ((400, 400, 10, 10), False),
+]
+
+
+def random_room(rng: random.Random, grid: int):
+    # Returns a room that may stick out of the grid on any side
+    w = rng.randint(0, 60)
+    h = rng.randint(0, 60)
+    return Room(rng.randint(-40, grid), rng.randint(-40, grid), w, h, 'test')
+
+
+def paths(collision: str, seeds: range):
+    start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, prefabs, collision=collision)
+    g.add_rotated_prefabs()
+    output = []
+    for seed in seeds:
+        g.rng = random.Random(seed)
+        g.reset_path(start)
+        g.build_dungeon()
+        output.append([(room.name, room.x, room.y, str(door)) for room, door in g.path])
+    return output
+
+
+@pytest.mark.parametrize('collision', ['index', 'bitmap'])
+@pytest.mark.parametrize('rectangle, expected', CASES)
+def test_overlaps(collision: str, rectangle: tuple, expected: bool):
+    if collision == 'bitmap':
+        pytest.importorskip('numpy')
+    start = Room(0, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, prefabs, collision=collision)
+    g.reset_path(Room(*BIG_ROOM, 'big'), Door(0, 0, 'N'))
+    assert g.overlaps(Room(*rectangle, 'test')) == expected
+    # Also with the big room as the one being tested
+    g.reset_path(Room(*rectangle, 'test'), Door(0, 0, 'N'))
+    assert g.overlaps(Room(*BIG_ROOM, 'big')) == expected
+
+
+def test_bitmap_hits_match_index():
+    pytest.importorskip('numpy')
+    # Adds and removes random rooms in both backends, comparing every query
+    rng = random.Random(0)
+    grid = 300
+    index = SpatialIndex(32)
+    bitmap = OccupancyGrid(grid, grid)
+    placed = []
+    for step in range(400):
+        if placed and rng.random() < .3:
+            room = placed.pop(rng.randrange(len(placed)))
+            index.remove(room)
+            bitmap.remove(room)
+        else:
+            room = random_room(rng, grid)
+            # Rooms are only ever placed inside the grid
+            room.x = min(max(room.x, 0), grid - room.w)
+            room.y = min(max(room.y, 0), grid - room.h)
+            placed.append(room)
+            index.add(room)
+            bitmap.add(room)
+        for i in range(5):
+            test_room = random_room(rng, grid)
+            # The bitmap only covers the grid, so rooms sticking out are only compared on their part inside it
+            clipped = Room(max(test_room.x, 0), max(test_room.y, 0), 0, 0, 'clipped')
+            clipped.w = min(test_room.x + test_room.w, grid) - clipped.x
+            clipped.h = min(test_room.y + test_room.h, grid) - clipped.y
+            if clipped.w >= 0 and clipped.h >= 0:
+                assert bitmap.hits(test_room) == index.hits(clipped)
+
+
+def test_bitmap_builds_match_index():
+    pytest.importorskip('numpy')
+    assert paths('bitmap', range(10)) == paths('index', range(10))
@@ -0,0 +1,66 @@
+import random
+from collections import deque
+import pytest
+from dungeonGeneratorClass import DungeonGenerator, Room, Door, prefabs
+from dungeonSerializer import generator_params
+
+np = pytest.importorskip('numpy')
+
+
+def generator(heuristic: str = 'field'):
+    start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, prefabs, heuristic=heuristic)
+    g.add_rotated_prefabs()
+    return g
+
+
+def reference_field(field):
+    # Breadth-first search from scratch over the field's free cells
+    output = np.full((field.cols, field.rows), field.UNREACHABLE, dtype=np.int64)
+    gx, gy = field.goal
+    output[gx, gy] = 0
+    queue = deque([(gx, gy)])
+    while queue:
+        x, y = queue.popleft()
+        for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if 0 <= nx < field.cols and 0 <= ny < field.rows and field.counts[nx, ny] == 0 \
+                    and output[nx, ny] == field.UNREACHABLE:
+                output[nx, ny] = output[x, y] + 1
+                queue.append((nx, ny))
+    return output
+
+
+def paths(g: DungeonGenerator, seeds: range):
+    output = []
+    for seed in seeds:
+        g.rng = random.Random(seed)
+        g.reset_path(g.start)
+        g.build_dungeon()
+        output.append([(room.name, room.x, room.y, str(door)) for room, door in g.path])
+    return output
+
+
+def test_incremental_field_matches_full_search():
+    # Checks the field after every placement, pop and restart against a search from scratch
+    g = generator()
+    events = 0
+    for seed in range(6):
+        g.rng = random.Random(seed)
+        g.reset_path(g.start)
+        for event in g.iter_build():
+            g.field.refresh()
+            assert (g.field.field[1:-1, 1:-1] == reference_field(g.field)).all()
+            events += 1
+    assert events > 50
+
+
+def test_skipped_refreshes_match_eager_refreshes():
+    # Rankings that skip pending updates (DistanceField.exact) must pick exactly what a refreshed field would
+    g = generator()
+    eager = generator()
+    eager.field.exact = lambda score: not (eager.field.added or eager.field.removed)
+    assert paths(g, range(8)) == paths(eager, range(8))
+
+
+def test_heuristic_is_part_of_the_cache_key():
+    assert generator_params(generator('field')) != generator_params(generator('euclid'))
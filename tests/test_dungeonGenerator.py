@@ -0,0 +1,81 @@
+import random
+import pytest
+from dungeonGeneratorClass import DungeonGenerator, DungeonBuildError, GeneratorConfig, Room, Door, prefabs, \
+    rotated_prefabs
+
+
+def generator(seed: int, path_length: int = 15):
+    start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, prefabs, rng=random.Random(seed),
+                         config=GeneratorConfig(path_length=path_length))
+    g.add_rotated_prefabs()
+    return g
+
+
+def test_long_paths_build_within_budget():
+    # The unbounded original loop managed 28 of these 30 seeds in 20,000 iterations
+    built = 0
+    for seed in range(30):
+        g = generator(seed, 30)
+        try:
+            g.build_dungeon()
+        except DungeonBuildError:
+            continue
+        assert len(g.path) == 31 and g.path[-1][0].name == 'finish'
+        built += 1
+    assert built >= 28
+
+
+def test_truncate_keeps_prefix_index_and_memo_in_sync():
+    g = generator(4)
+    g.build_dungeon()
+    full = list(g.path)
+    popped = g.truncate(6)
+    assert g.path == full[:6]
+    assert popped == full[:5:-1]
+    indexed = {key for bucket in g.index.buckets.values() for key in bucket}
+    assert indexed == {id(room) for room, door in full[:6]}
+    # Every remembered collision still holds against the kept rooms, and each is filed under one path length
+    assert g.collision_memo
+    assert sum(len(keys) for keys in g.memo_levels) == len(g.collision_memo)
+    assert len(g.memo_levels) <= len(g.path) + 1
+    for key in g.collision_memo:
+        assert g.overlaps(Room(*key, 'memo'))
+    with pytest.raises(ValueError):
+        g.truncate(0)
+
+
+def test_reroll_keeps_goal_through_restarts():
+    g = generator(4)
+    g.build_dungeon()
+    goal = g.goal
+    g.truncate(2)
+    # A budget this small restarts every 10 attempts, too few to place the 14 missing rooms
+    restarts = 0
+    try:
+        for event in g.iter_build(max_attempts=40, max_restarts=3, new_goal=False):
+            restarts += event.kind == 'restart'
+    except DungeonBuildError:
+        pass
+    assert restarts > 0
+    assert g.goal == goal
+    g.truncate(2)
+    g.reroll(2)
+    assert g.goal == goal and g.path[-1][0].name == 'finish'
+
+
+def test_rotations_dedupe_like_room_equality():
+    # The original quadratic dedupe, comparing with Room.__eq__
+    def by_equality(rooms: list):
+        output = list(rooms)
+        for room in rooms:
+            for degree in [90, 180, 270]:
+                rotated_room = room.get_rotated(degree)
+                if rotated_room not in output:
+                    output.append(rotated_room)
+        return output
+
+    doors = [Door(0, 5, 'W'), Door(10, 5, 'E')]
+    rooms = list(prefabs) + [Room(0, 0, 10, 10, 'corridor', doors),
+                             Room(0, 0, 10, 10, 'doubled corridor', doors[:1] + doors)]
+    assert [room.name for room in rotated_prefabs(rooms)] == [room.name for room in by_equality(rooms)]
@@ -0,0 +1,83 @@
+import os
+import random
+import tempfile
+import pytest
+from dungeonGeneratorClass import DungeonGenerator, PrefabCatalog, Room, Door, prefabs
+from dungeonSerializer import DungeonCache, DungeonStore, MAX_PREFABS, decode, decode_many, encode, encode_many, \
+    from_json, to_json, write_store
+
+
+def generator(extra: list = ()):
+    start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, list(prefabs) + list(extra), rng=random.Random(1))
+    g.add_rotated_prefabs()
+    return g
+
+
+def signature(path: list):
+    return [(room.name, room.x, room.y, room.w, room.h, str(door)) for room, door in path]
+
+
+def dungeons(g: DungeonGenerator, count: int):
+    output = []
+    for i in range(count):
+        g.reset_path(g.start)
+        g.build_dungeon()
+        output.append((list(g.path), g.goal))
+    return output
+
+
+def test_encode_and_json_round_trip():
+    g = generator()
+    for path, goal in dungeons(g, 5):
+        for decoded, decoded_goal in [decode(g, encode(g, path, goal)), from_json(g, to_json(g, path, goal))]:
+            assert signature(decoded) == signature(path)
+            assert decoded_goal == goal
+
+
+def test_json_rejects_other_catalog():
+    g = generator()
+    g.build_dungeon()
+    other = generator([Room(0, 0, 30, 30, 'extra', [Door(15, 0, 'S'), Door(15, 30, 'N')])])
+    with pytest.raises(ValueError):
+        from_json(other, to_json(g))
+
+
+def test_bulk_and_store_round_trip():
+    pytest.importorskip('numpy')
+    g = generator()
+    built = dungeons(g, 8)
+    for decoded, (path, goal) in zip(decode_many(g, *encode_many(g, built)), built):
+        assert signature(decoded[0]) == signature(path) and decoded[1] == goal
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'dungeons.dgs')
+    assert write_store(filename, g, iter(built)) == len(built)
+    store = DungeonStore(filename)
+    assert len(store) == len(built)
+    for i, (path, goal) in enumerate(built):
+        decoded, decoded_goal = store.dungeon(g, i)
+        assert signature(decoded) == signature(path) and decoded_goal == goal
+    empty = os.path.join(directory, 'empty.dgs')
+    assert write_store(empty, g, []) == 0
+    assert len(DungeonStore(empty)) == 0
+
+
+def test_cache_round_trip():
+    g = generator()
+    cache = DungeonCache(tempfile.mkdtemp())
+    assert not cache.build(g, 'seed')
+    built = signature(g.path), g.goal
+    g.reset_path(g.start)
+    assert cache.build(g, 'seed')
+    assert (signature(g.path), g.goal) == built
+    # The restored dungeon is the generator's current one, collision state included
+    assert g.overlaps(g.path[-1][0])
+
+
+def test_oversized_catalog_is_rejected_up_front():
+    g = generator()
+    g.build_dungeon()
+    rooms = [Room(0, 0, 10, 10, 'room ' + str(i), [Door(5, 0, 'S'), Door(5, 10, 'N')]) for i in range(MAX_PREFABS)]
+    large = DungeonGenerator(g.start, 500, 500, rooms, catalog=PrefabCatalog(rooms))
+    with pytest.raises(ValueError, match='prefabs'):
+        encode(large, [g.path[0]], g.goal)
@@ -0,0 +1,41 @@
+import asyncio
+import json
+import pytest
+from generatorServer import GeneratorServer, RequestError, parse_request
+from dungeonGeneratorClass import prefabs
+
+PREFAB_SETS = {'default': prefabs}
+
+
+async def exchange(server: GeneratorServer, body: bytes):
+    # Sends one POST /generate to server.handle over a real socket, without the worker pool behind it
+    listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'POST /generate HTTP/1.1\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+    payload = await reader.readexactly(length)
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
+    return int(head.split()[1]), json.loads(payload)
+
+
+@pytest.mark.parametrize('body', [b'\xff\xfe{', b'{"seed": ', b'[1, 2'])
+def test_undecodable_body_is_answered_400(body: bytes):
+    status, payload = asyncio.run(exchange(GeneratorServer(PREFAB_SETS), body))
+    assert status == 400
+    assert payload['error'].startswith('Invalid JSON')
+
+
+@pytest.mark.parametrize('body', [{'path_length': True}, {'grid': True}, {'grid': [500, False]}, {'seed': True}])
+def test_booleans_are_not_integers(body: dict):
+    with pytest.raises(RequestError):
+        parse_request(body, PREFAB_SETS)
+
+
+def test_valid_request_gets_defaults():
+    request = parse_request({'grid': [400, 600], 'path_length': 20, 'seed': 7}, PREFAB_SETS)
+    assert request == {'grid': [400, 600], 'path_length': 20, 'prefabs': 'default', 'seed': 7}
@@ -0,0 +1,38 @@
+import random
+import pytest
+from dungeonGeneratorClass import DungeonGenerator, PrefabCatalog, Room, Door, OPPOSITE, prefabs, rotated_prefabs
+from benchmark import synthetic_prefabs
+
+pytest.importorskip('numpy')
+
+
+def paths(scoring: str, extra: int, seeds: range):
+    start = Room(230, 0, 20, 10, 'start', [Door(10, 10, 'N')])
+    g = DungeonGenerator(start, 500, 500, list(prefabs) + synthetic_prefabs(extra), scoring=scoring)
+    g.add_rotated_prefabs()
+    output = []
+    for seed in seeds:
+        g.rng = random.Random(seed)
+        g.reset_path(start)
+        g.build_dungeon()
+        output.append([(room.name, room.x, room.y, str(door)) for room, door in g.path])
+    return output
+
+
+def test_vector_rank_matches_scalar():
+    rng = random.Random(0)
+    catalog = PrefabCatalog(rotated_prefabs(list(prefabs) + synthetic_prefabs(40)))
+    names = [room.name for room in catalog.prefabs]
+    for i in range(500):
+        active_door = Door(rng.randint(0, 500), rng.randint(0, 500), rng.choice(list(OPPOSITE)))
+        goal = (rng.randint(0, 500), rng.randint(0, 500))
+        exclude = set(rng.sample(names, rng.randint(0, 5)))
+        available, best = catalog.rank(active_door, goal, exclude, vector=True)
+        scalar_available, scalar_best = catalog.rank(active_door, goal, exclude, vector=False)
+        assert list(available) == scalar_available
+        assert best == scalar_best
+
+
+def test_vector_builds_match_scalar():
+    assert paths('vector', 0, range(10)) == paths('scalar', 0, range(10))
+    assert paths('vector', 60, range(5)) == paths('scalar', 60, range(5))
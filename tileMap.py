@@ -0,0 +1,68 @@
+from __future__ import annotations
+from dungeonGeneratorClass import DungeonGenerator, load_numpy
+
+
+# Tile values; rooms are closed rectangles, so a room at x with width w covers tile columns x through x + w
+VOID = 0
+FLOOR = 1
+WALL = 2
+DOOR = 3
+
+
+def tile_shape(generator: DungeonGenerator):
+    # Returns the (rows, columns) of a generator's tile map, indexed tiles[y, x]
+    return generator.grid_h + 1, generator.grid_w + 1
+
+
+def path_doors(path: list, unused_doors: bool = False):
+    # Yields the world position of every door that joins two rooms of the path (and every other door of its rooms
+    # when unused_doors is true)
+    for i, (room, door) in enumerate(path):
+        for j in range(len(room.doors)):
+            exit_door = room.get_door(j)
+            if unused_doors or j == room.entrance_i or (i < len(path) - 1 and exit_door == door):
+                yield exit_door.x, exit_door.y
+
+
+def rasterize(generator: DungeonGenerator, path: list = None, out=None, clear: bool = True,
+              unused_doors: bool = False):
+    # Returns a uint8 tile map of a path (by default the generator's current path): WALL on every room's outline,
+    # FLOOR inside it, DOOR on the doors joining rooms and VOID elsewhere
+    # Each room is two slice assignments, so the cost is per room, never per tile
+    # out is an optional array of tile_shape(generator) to fill (e.g. from open_tile_memmap); it is zeroed first
+    # unless clear is false, which saves touching every page of a freshly created memmap
+    np = load_numpy()
+    path = generator.path if path is None else path
+    if out is None:
+        out = np.zeros(tile_shape(generator), dtype=np.uint8)
+    elif clear:
+        out[...] = VOID
+    for room, door in path:
+        out[room.y:room.y + room.h + 1, room.x:room.x + room.w + 1] = WALL
+        out[room.y + 1:room.y + room.h, room.x + 1:room.x + room.w] = FLOOR
+    doors = list(path_doors(path, unused_doors))
+    if doors:
+        xs, ys = zip(*doors)
+        out[list(ys), list(xs)] = DOOR
+    return out
+
+
+def open_tile_memmap(filename: str, generator: DungeonGenerator, count: int = None, mode: str = 'w+'):
+    # Returns a memory-mapped .npy tile array for one map (count None) or count stacked maps of the generator's grid
+    # A new file reads as all VOID without being written, and only the pages rasterized into are ever touched, so
+    # maps far larger than memory work; the file can be reopened with numpy.load(filename, mmap_mode='r')
+    np = load_numpy()
+    shape = tile_shape(generator) if count is None else (count,) + tile_shape(generator)
+    return np.lib.format.open_memmap(filename, mode=mode, dtype=np.uint8, shape=shape)
+
+
+def rasterize_many(generator: DungeonGenerator, paths: list, out=None, clear: bool = True,
+                   unused_doors: bool = False):
+    # Returns the tile maps of a batch of paths stacked into one (len(paths), rows, columns) uint8 array
+    # out, clear and unused_doors are as for rasterize, out having the stacked shape
+    np = load_numpy()
+    if out is None:
+        out = np.zeros((len(paths),) + tile_shape(generator), dtype=np.uint8)
+    for i, path in enumerate(paths):
+        rasterize(generator, path, out[i], clear, unused_doors)
+    return out